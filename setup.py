@@ -23,4 +23,8 @@ setuptools.setup(
     package_dir={"": "src"},
     packages=setuptools.find_packages(where="src"),
     python_requires=">=3.6",
+    extras_require={
+        # Parquet datasets (data_generators.functions.store_chunks) and LocalBackend tables
+        "parquet": ["pyarrow"],
+    },
 )
@@ -1,5 +1,21 @@
+import os
+import pickle
+import shutil
+import uuid
+from datetime import datetime
+from functools import partial
+
+import numpy as np
 import tensorflow.keras
 
+from ..utils.evaluation.functions import predict_datagen, evaluate_predictions
+from .callbacks import BestWeights, AtomicModelCheckpoint, save_atomic
+
+
+def _dump_pickle_(obj, path):
+    with open(path, "wb") as f:
+        pickle.dump(obj, f)
+
 
 class IterativeModel(tensorflow.keras.Model):
 
@@ -7,6 +23,12 @@ class IterativeModel(tensorflow.keras.Model):
         super(IterativeModel, self).__init__(**kwargs)
         self.compilation_kwargs = {}
 
+        # Directory with artifacts of the last fit_iterative run
+        self.run_dir = None
+
+        # Test set evaluation of the last fit_iterative run (see evaluation.functions.evaluate_predictions)
+        self.evaluation = None
+
     @staticmethod
     def __name__():
         return "IterativeModel"
@@ -35,6 +57,115 @@ class IterativeModel(tensorflow.keras.Model):
 
         super(IterativeModel, self).compile(**kwargs)
 
+    def _get_optimizer_variables_(self):
+        variables = self.optimizer.variables
+        return variables() if callable(variables) else variables
+
+    def _build_optimizer_(self):
+        if hasattr(self.optimizer, "build") and not getattr(self.optimizer, "built", True):
+            self.optimizer.build(self.trainable_variables)
+
+    def snapshot(self):
+        """
+        Returns in-memory copy of model weights and optimizer state (optimizer is built if needed).
+        :return: (list of weights, list of optimizer variable values)
+        """
+        self._build_optimizer_()
+
+        return self.get_weights(), [variable.numpy() for variable in self._get_optimizer_variables_()]
+
+    def restore(self, snapshot):
+        """
+        Restores weights and optimizer state returned by snapshot, without re-compiling the model.
+        :param snapshot: output of snapshot()
+        """
+        weights, optimizer_values = snapshot
+
+        self._build_optimizer_()
+        self.set_weights(weights)
+        for variable, value in zip(self._get_optimizer_variables_(), optimizer_values):
+            variable.assign(value)
+
+    def _set_best_weights_(self, best_weights):
+        """
+        Sets weights tracked by BestWeights callback (if any epoch was evaluated).
+        """
+        if best_weights.best_weights is not None:
+            self.set_weights(best_weights.best_weights)
+
+    def _reset_learning_rate_(self, learning_rate):
+        """
+        Resets optimizer step counter (and with it learning rate schedule) and learning rate to given value.
+        """
+        self.optimizer.iterations.assign(0)
+
+        if hasattr(self.optimizer.learning_rate, "assign"):
+            self.optimizer.learning_rate.assign(learning_rate)
+
+    def _save_iteration_state_(self, completed, history, sampler, best_callback):
+        """
+        Stores everything needed to resume fit_iterative after "completed" iterations (0 => after the initial
+        fit): model weights, optimizer state, merged history, best value (and best weights) and sampler state.
+        State is written to a temporary directory which is then renamed, older states are removed afterwards.
+        """
+        states_dir = os.path.join(self.run_dir, "state")
+        name = f"iteration_{completed:04d}"
+        tmp_path = os.path.join(states_dir, f".tmp-{os.getpid()}-{name}")
+
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        weights, optimizer_values = self.snapshot()
+        state = {
+            "completed": completed,
+            "history": history,
+            "weights": weights,
+            "optimizer": optimizer_values,
+            "best": best_callback.best,
+            "best_weights": getattr(best_callback, "best_weights", None)
+        }
+
+        _dump_pickle_(state, os.path.join(tmp_path, "model_state.pkl"))
+
+        sampler.save_state(os.path.join(tmp_path, "sampler"))
+
+        shutil.rmtree(os.path.join(states_dir, name), ignore_errors=True)
+        os.rename(tmp_path, os.path.join(states_dir, name))
+
+        for old_name in os.listdir(states_dir):
+            if old_name.startswith("iteration_") and old_name != name:
+                shutil.rmtree(os.path.join(states_dir, old_name), ignore_errors=True)
+
+    def _load_iteration_state_(self, sampler, best_callback):
+        """
+        Restores the last state stored by _save_iteration_state_.
+        :return: (number of completed iterations, history) or None if the run has no stored state
+        """
+        states_dir = os.path.join(self.run_dir, "state")
+
+        if not os.path.isdir(states_dir):
+            return None
+
+        names = sorted(name for name in os.listdir(states_dir) if name.startswith("iteration_"))
+        if not names:
+            return None
+
+        path = os.path.join(states_dir, names[-1])
+
+        with open(os.path.join(path, "model_state.pkl"), "rb") as f:
+            state = pickle.load(f)
+
+        self.restore((state["weights"], state["optimizer"]))
+        best_callback.best = state["best"]
+        if state["best_weights"] is not None:
+            best_callback.best_weights = state["best_weights"]
+
+        sampler.load_state(os.path.join(path, "sampler"))
+
+        print(f"⏩ Resuming after iteration {state['completed']}\n")
+
+        return state["completed"], state["history"]
+
     def load(self, filepath):
         return tensorflow.keras.models.load_model(
             filepath, custom_objects={self.__name__(): self}
@@ -44,6 +175,19 @@ class IterativeModel(tensorflow.keras.Model):
                       sampler=None,
                       num_iterations=5,
                       recompile=True,
+                      reset_mode="memory",
+                      use_tf_data=False,
+                      keep_best="memory",
+                      save_best_model=False,
+                      artifact_dir="runs",
+                      run_id=None,
+                      model_name="best_model",
+                      warm_start=False,
+                      warm_start_epochs=None,
+                      early_stopping_patience=None,
+                      reset_learning_rate=False,
+                      save_state=None,
+                      resume=False,
                       **kwargs):
 
         """
@@ -54,25 +198,89 @@ class IterativeModel(tensorflow.keras.Model):
         :param sampler: Sampler
         :param num_iterations: number of training iterations
         :param recompile: if True, model is compiled after each iteration (starts learning from scratch)
+        :param reset_mode: how the model is reset when recompile is True
+            - memory - initial weights and optimizer state are kept in memory and restored (no re-compilation)
+            - disk - initial weights are saved to a file, loaded and the model is compiled again
+        :param use_tf_data: if True, data are fed by tf.data pipelines (sampler.get_tf_datasets) instead of
+            keras Sequences
+        :param keep_best: how the best model (by val_loss) is kept for sampling and evaluation
+            - memory - best weights are kept in memory (BestWeights callback) and swapped into this model
+            - disk - best model is saved to the run directory after each improvement and loaded from it
+        :param save_best_model: if True (or in disk mode), the best model is saved as "{model_name}.h5" to the
+            run directory
+        :param artifact_dir: directory with run directories (weights, checkpoints, ...)
+        :param run_id: name of the run directory, unique id is generated if not given (so that multiple runs
+            can share working directory)
+        :param model_name: file name (without extension) of the saved best model
+        :param warm_start: if True, each iteration continues training from the best weights of the previous ones
+            (overrides recompile)
+        :param warm_start_epochs: number of epochs of warm started iterations (defaults to "epochs")
+        :param early_stopping_patience: if set, training stops after this number of epochs without improvement
+            of val_loss (applies to all iterations)
+        :param reset_learning_rate: if True, learning rate (and its schedule) is reset before warm started iterations
+        :param save_state: if True, state of training (model, optimizer, history, sampler datasets and random
+            state) is stored to the run directory after each iteration (None => only if run_id is given, runs
+            with generated ids cannot be resumed)
+        :param resume: if True, run "run_id" is resumed from its last stored state (started if there is none)
         :param kwargs: kwargs provided for keras.model.fit function
-        :return:
+        :return: history, best model (this model with best weights in memory mode)
         """
 
+        if resume is True and run_id is None:
+            raise ValueError("run_id of the resumed run has to be specified")
+
+        if save_state is None:
+            save_state = run_id is not None
+
+        if run_id is None:
+            run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+        self.run_dir = os.path.join(artifact_dir, run_id)
+        os.makedirs(self.run_dir, exist_ok=True)
+
+        best_model_path = os.path.join(self.run_dir, f"{model_name}.h5")
+        initial_weights_path = os.path.join(self.run_dir, "initial.weights.h5")
+
+        initial_state_path = os.path.join(self.run_dir, "initial_state.pkl")
+
         if recompile is True:
-            # Save initial weights for later use
-            self.save_weights("initial_weights")
+            # Save initial weights for later use (a resumed run uses weights of the original one)
+            if reset_mode == "memory":
+                if resume is True and os.path.exists(initial_state_path):
+                    with open(initial_state_path, "rb") as f:
+                        initial_state = pickle.load(f)
+                else:
+                    initial_state = self.snapshot()
+                    if save_state is True:
+                        save_atomic(partial(_dump_pickle_, initial_state), initial_state_path)
+
+            elif not (resume is True and os.path.exists(initial_weights_path)):
+                save_atomic(self.save_weights, initial_weights_path)
 
         kwargs['batch_size'] = kwargs.get('batch_size', 256)
         kwargs['epochs'] = kwargs.get('epochs', 50)
 
-        train_datagen, val_datagen, test_datagen = sampler.get_data(kwargs['batch_size'])
+        if warm_start is True:
+            initial_learning_rate = float(np.asarray(self.optimizer.learning_rate))
 
         # ------------------------------------------------------------------------ #
         # Init with checkpoints passed from user, add functional checkpoint
         kwargs['callbacks'] = [callback for callback in kwargs.get("callbacks", [])]
-        # TODO: give possibility to rename model
         # TODO: check if this callback is not already applied
-        kwargs['callbacks'].insert(0, tensorflow.keras.callbacks.ModelCheckpoint("best_model.h5", save_best_only=True, verbose=0))
+        if keep_best == "memory":
+            best_weights = best_callback = BestWeights(monitor="val_loss")
+        else:
+            best_callback = AtomicModelCheckpoint(best_model_path, monitor="val_loss")
+        kwargs['callbacks'].insert(0, best_callback)
+
+        if early_stopping_patience is not None:
+            kwargs['callbacks'].append(tensorflow.keras.callbacks.EarlyStopping(monitor="val_loss",
+                                                                                patience=early_stopping_patience))
+
+        # Iterations share the callbacks (best value is kept across fit calls), only epochs may differ
+        iteration_kwargs = kwargs
+        if warm_start is True and warm_start_epochs is not None:
+            iteration_kwargs = dict(kwargs, epochs=warm_start_epochs)
 
         print("\n")
 
@@ -80,42 +288,94 @@ class IterativeModel(tensorflow.keras.Model):
         print(" Training")
         print("-" * 30)
 
-        # Run the initial fit, save model
-        history = self.fit(x=train_datagen,
-                           validation_data=val_datagen,
-                           **kwargs).history
+        state = self._load_iteration_state_(sampler, best_callback) if resume is True else None
+
+        if use_tf_data is True:
+            train_datagen, val_datagen, test_datagen = sampler.get_tf_datasets(kwargs['batch_size'])
+        else:
+            train_datagen, val_datagen, test_datagen = sampler.get_data(kwargs['batch_size'])
+
+        if state is None:
+            # Run the initial fit, save model
+            history = self.fit(x=train_datagen,
+                               validation_data=val_datagen,
+                               **kwargs).history
+
+            completed = 0
+            if save_state is True:
+                self._save_iteration_state_(completed, history, sampler, best_callback)
+        else:
+            completed, history = state
 
-        for iteration in range(num_iterations):
+        for iteration in range(completed, num_iterations):
             # ---------------------------------------------------------------------- #
             # Evaluate current model performance and based on its sampling strategy,
             # add new training data to the current training ones.
 
-            model = self.load('best_model.h5')
-            train_datagen, val_datagen = sampler.on_training_end(model, kwargs['batch_size'], iteration, test_datagen)
+            if keep_best == "memory":
+                current_weights = self.get_weights()
+                self._set_best_weights_(best_weights)
+                train_datagen, val_datagen = sampler.on_training_end(self, kwargs['batch_size'], iteration, test_datagen)
+
+                # Continue training from the last weights (as in disk mode)
+                if recompile is False and warm_start is False:
+                    self.set_weights(current_weights)
+            else:
+                model = self.load(best_model_path)
+                train_datagen, val_datagen = sampler.on_training_end(model, kwargs['batch_size'], iteration, test_datagen)
+
+            if use_tf_data is True:
+                # Rebuild pipelines from the updated sampler datasets
+                train_datagen, val_datagen, test_datagen = sampler.get_tf_datasets(kwargs['batch_size'])
+
+            if warm_start is True:
+                print("🔥 Warm start from the best model\n")
+                if keep_best == "memory":
+                    self._set_best_weights_(best_weights)
+                else:
+                    self.set_weights(model.get_weights())
+
+                if reset_learning_rate is True:
+                    self._reset_learning_rate_(initial_learning_rate)
 
             # Recompile model to start training from beginning
-            if recompile is True:
+            elif recompile is True:
                 print("🔁 Resetting model\n")
-                self.load_weights("initial_weights")
-                self.compile(**self.compilation_kwargs)
+                if reset_mode == "memory":
+                    self.restore(initial_state)
+                else:
+                    self.load_weights(initial_weights_path)
+                    self.compile(**self.compilation_kwargs)
 
             new_history = self.fit(x=train_datagen,
                                    validation_data=val_datagen,
-                                   **kwargs).history
+                                   **iteration_kwargs).history
 
             history = self.__merge_history(history, new_history)
 
+            if save_state is True:
+                self._save_iteration_state_(iteration + 1, history, sampler, best_callback)
+
         print("\n")
 
         print("-" * 30)
         print(" Evaluation")
         print("-" * 30)
 
-        model = self.load('best_model.h5')
-        results = model.evaluate(test_datagen, batch_size=kwargs['batch_size'], verbose=0)
+        if keep_best == "memory":
+            self._set_best_weights_(best_weights)
+            model = self
+
+            if save_best_model is True:
+                save_atomic(self.save, best_model_path)
+        else:
+            model = self.load(best_model_path)
+
+        # Each test sample is predicted once, predictions are kept for logging
+        self.evaluation = evaluate_predictions(*predict_datagen(model, test_datagen, kwargs['batch_size']))
 
         print("\nTest results:\n")
-        print("binary accuracy \t\t loss")
-        print(f"{results[1]} \t\t {results[0]}")
+        print("binary accuracy \t\t loss \t\t AUC")
+        print(f"{self.evaluation['accuracy']} \t\t {self.evaluation['loss']} \t\t {self.evaluation['roc_auc']}")
 
         return history, model
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import tensorflow.keras
+
+
+class BestWeights(tensorflow.keras.callbacks.Callback):
+    """
+    Keeps weights of the best epoch in memory (same purpose as ModelCheckpoint with save_best_only=True,
+    without saving and loading the model). The best value is kept across multiple fit calls.
+    """
+
+    def __init__(self, monitor="val_loss", mode="auto"):
+        """
+        :param monitor: quantity to monitor
+        :param mode: one of min, max, auto (max if monitor is accuracy or AUC, else min)
+        """
+        super(BestWeights, self).__init__()
+
+        if mode == "auto":
+            mode = "max" if ("acc" in monitor or "auc" in monitor) else "min"
+
+        self.monitor = monitor
+        self.monitor_op = np.less if mode == "min" else np.greater
+        self.best = np.inf if mode == "min" else -np.inf
+        self.best_weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = (logs or {}).get(self.monitor)
+
+        if current is not None and self.monitor_op(current, self.best):
+            self.best = current
+            self._on_improvement_()
+
+    def _on_improvement_(self):
+        self.best_weights = self.model.get_weights()
+
+
+class AtomicModelCheckpoint(BestWeights):
+    """
+    Saves the best model to filepath. Model is written to a temporary file which then replaces filepath,
+    so the file is never left partially written.
+    """
+
+    def __init__(self, filepath, monitor="val_loss", mode="auto"):
+        super(AtomicModelCheckpoint, self).__init__(monitor=monitor, mode=mode)
+        self.filepath = filepath
+
+    def _on_improvement_(self):
+        save_atomic(self.model.save, self.filepath)
+
+
+def save_atomic(save, filepath):
+    """
+    Calls save(path) with a temporary path in the same directory and renames the result to filepath.
+    :param save: function saving to the given path (e.g. model.save, model.save_weights)
+    :param filepath: str => target path
+    """
+    directory, file_name = os.path.split(filepath)
+    tmp_path = os.path.join(directory, f".tmp-{os.getpid()}-{file_name}")
+
+    try:
+        save(tmp_path)
+        os.replace(tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,166 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import tensorflow.keras
+
+from .base import IterativeModel
+from .callbacks import BestWeights, save_atomic
+from ..utils.data_generators.base import VectorizedDataCreator
+from ..utils.encoders.base import VectorizedEncoder
+from ..utils.samplers.base import BaseSampler
+
+
+class IterativeModelTester(unittest.TestCase):
+
+    df_mirna = pd.DataFrame(data={
+        "Mature sequence": ["UGAGGUAGUAGGUUGUAUAGUU", "UAGCAGCACGUAAAUAUUGGCG", "AAAGUGCUUACAGUGCAGGUAG",
+                            "UGGAAUGUAAAGAAGUAUGUAU", "UAAAGUGCUUAUAGUGCAGGUA", "UUCAAGUAAUCCAGGAUAGGCU"] * 5
+    })
+
+    def make_sampler(self, rng=0, negative_ratio=2):
+        return BaseSampler(negative_ratio, self.df_mirna, VectorizedDataCreator(rng=rng), VectorizedEncoder(),
+                           storage="packed")
+
+    @staticmethod
+    def make_model():
+        inputs = tensorflow.keras.Input((50, 26, 1))
+        x = tensorflow.keras.layers.Flatten()(inputs)
+        outputs = tensorflow.keras.layers.Dense(1, activation="sigmoid")(x)
+
+        model = IterativeModel(inputs=inputs, outputs=outputs)
+        model.compile(optimizer="adam", loss="binary_crossentropy", metrics=["binary_accuracy"])
+        return model
+
+    def setUp(self):
+        self.artifact_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.artifact_dir.cleanup)
+
+    def test_warm_start_callbacks(self):
+        model = self.make_model()
+
+        with mock.patch.object(BestWeights, "on_epoch_end", autospec=True,
+                               side_effect=BestWeights.on_epoch_end) as on_epoch_end:
+            history, _ = model.fit_iterative(self.make_sampler(), num_iterations=2, epochs=2, verbose=0,
+                                             warm_start=True, warm_start_epochs=1,
+                                             artifact_dir=self.artifact_dir.name)
+
+        with self.subTest():
+            self.assertEqual(len(history["loss"]), 4)
+
+        # Best weights are tracked in warm started iterations too
+        with self.subTest():
+            self.assertEqual(on_epoch_end.call_count, 4)
+
+        with self.subTest():
+            self.assertEqual(on_epoch_end.call_args.args[0].best, min(history["val_loss"]))
+
+    def test_snapshot_and_restore(self):
+        model = self.make_model()
+        x, y = np.random.random((32, 50, 26, 1)), np.random.randint(0, 2, (32, 1))
+
+        snapshot = model.snapshot()
+        model.fit(x, y, epochs=1, verbose=0)
+        model.restore(snapshot)
+
+        weights, optimizer_values = model.snapshot()
+
+        with self.subTest():
+            self.assertGreater(len(optimizer_values), 0)
+
+        for expected, value in zip(snapshot[0] + snapshot[1], weights + optimizer_values):
+            with self.subTest():
+                np.testing.assert_array_equal(expected, value)
+
+    def test_best_weights(self):
+        model = self.make_model()
+        callback = BestWeights(monitor="val_loss")
+        callback.set_model(model)
+
+        for epoch, val_loss in enumerate([3., 1., 2.]):
+            model.set_weights([np.full_like(w, epoch) for w in model.get_weights()])
+            callback.on_epoch_end(epoch, {"val_loss": val_loss})
+
+        with self.subTest():
+            self.assertEqual(callback.best, 1.)
+
+        with self.subTest():
+            self.assertTrue(all((w == 1).all() for w in callback.best_weights))
+
+        with self.subTest():
+            self.assertIs(BestWeights(monitor="val_auc").monitor_op, np.greater)
+
+    def test_save_atomic(self):
+        path = os.path.join(self.artifact_dir.name, "file.txt")
+
+        def write(content):
+            def save(file_path):
+                with open(file_path, "w") as f:
+                    f.write(content)
+            return save
+
+        def fail(file_path):
+            write("partial")(file_path)
+            raise OSError("disk full")
+
+        save_atomic(write("saved"), path)
+
+        with self.subTest():
+            self.assertRaises(OSError, save_atomic, fail, path)
+
+        # Failed save leaves the previous file and no temporary file
+        with open(path) as f:
+            with self.subTest():
+                self.assertEqual(f.read(), "saved")
+
+        with self.subTest():
+            self.assertEqual(os.listdir(self.artifact_dir.name), ["file.txt"])
+
+    def test_save_state_and_resume(self):
+        sampler = self.make_sampler()
+        history, _ = self.make_model().fit_iterative(sampler, num_iterations=1, epochs=2, verbose=0,
+                                                     run_id="run", artifact_dir=self.artifact_dir.name)
+
+        with self.subTest():
+            self.assertEqual(os.listdir(os.path.join(self.artifact_dir.name, "run", "state")), ["iteration_0001"])
+
+        # Different creator seed => datasets have to be restored from the state
+        resumed_sampler = self.make_sampler(rng=1)
+        resumed_history, _ = self.make_model().fit_iterative(resumed_sampler, num_iterations=2, epochs=2, verbose=0,
+                                                             run_id="run", artifact_dir=self.artifact_dir.name,
+                                                             resume=True)
+
+        with self.subTest():
+            self.assertEqual(len(resumed_history["loss"]), 6)
+
+        with self.subTest():
+            self.assertEqual(resumed_history["loss"][:4], history["loss"])
+
+        for split in ["train_p", "val_n", "test_n"]:
+            with self.subTest(split=split):
+                np.testing.assert_array_equal(getattr(sampler, split), getattr(resumed_sampler, split))
+
+    def test_no_state_without_run_id(self):
+        model = self.make_model()
+        model.fit_iterative(self.make_sampler(), num_iterations=1, epochs=1, verbose=0,
+                            artifact_dir=self.artifact_dir.name)
+
+        self.assertFalse(os.path.exists(os.path.join(model.run_dir, "state")))
+
+    def test_tf_data_test_set_is_fixed(self):
+        # Growing negative ratio adds negatives to the training set only
+        sampler = self.make_sampler(negative_ratio=lambda iteration: 1 + iteration)
+        num_test, num_train_negatives = len(sampler.test_p) + len(sampler.test_n), len(sampler.train_n)
+
+        model = self.make_model()
+        model.fit_iterative(sampler, num_iterations=1, epochs=1, verbose=0, use_tf_data=True,
+                            artifact_dir=self.artifact_dir.name)
+
+        with self.subTest():
+            self.assertEqual(len(model.evaluation["labels"]), num_test)
+
+        with self.subTest():
+            self.assertGreater(len(sampler.train_n), num_train_negatives)
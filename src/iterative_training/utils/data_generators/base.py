@@ -4,8 +4,15 @@ import tensorflow as tf
 import numpy as np
 import pandas as pd
 import math
+import functools
+import os
+from multiprocessing import Pool
 from random import randint, sample
 
+from ..encoders.functions import expand_tensor
+from .functions import MUTATION_MODES, sequences_to_codes, codes_to_sequences, get_mutation_rates, \
+    create_targets, store_chunks
+
 
 class BaseDataGenerator(tf.keras.utils.Sequence):
     """
@@ -17,53 +24,254 @@ class BaseDataGenerator(tf.keras.utils.Sequence):
                  x_set_positive, y_set_positive,
                  x_set_negative, y_set_negative,
                  class_ratio,
-                 batch_size):
+                 batch_size,
+                 transform=None,
+                 shuffle=True,
+                 minority="cycle",
+                 seed=None):
+        """
+        One epoch covers each sample of the larger class (relative to its share in batches) exactly once,
+        samples of the other class are reused to keep the class ratio in every batch. Without shuffling (validation,
+        test) each sample is returned exactly once, in order (positives first), class_ratio is not used.
+
+        :param transform: function applied to x of each batch (e.g. expands compactly stored samples to float32)
+        :param shuffle: if True, samples are drawn by class_ratio and shuffled at the end of each epoch
+        :param minority: how the class running out of samples is reused within an epoch
+            - cycle - starts again from the beginning (of a new permutation)
+            - oversample - missing samples are drawn randomly with replacement
+        :param seed: seed of the generator's own random generator
+        """
         self.x_positive, self.y_positive = x_set_positive, y_set_positive
         self.x_negative, self.y_negative = x_set_negative, y_set_negative
 
-        # Figure out how many positive and negative samples to include in batches
-        class_ratio_positive, class_ratio_negative = class_ratio
-        self.positive_in_batch = int(
-            class_ratio_positive * (batch_size / (class_ratio_positive + class_ratio_negative)))
-        self.negative_in_batch = int(
-            class_ratio_negative * (batch_size / (class_ratio_positive + class_ratio_negative)))
-
         self.batch_size = batch_size
+        self.transform = transform
+        self.shuffle = shuffle
+        self.minority = minority
+        self.rng = np.random.default_rng(seed)
+
+        self.positive_order = None
+        self.negative_order = None
+
+        self.set_class_ratio(class_ratio)
+
+    def set_data(self, x_set_positive, y_set_positive, x_set_negative, y_set_negative):
+        """
+        Replaces samples (e.g. when datasets grew), set_class_ratio has to be called afterwards
+        to prepare a new epoch.
+        """
+        self.x_positive, self.y_positive = x_set_positive, y_set_positive
+        self.x_negative, self.y_negative = x_set_negative, y_set_negative
+
+    def set_class_ratio(self, class_ratio):
+        """
+        Sets how many positive and negative samples are included in batches and prepares a new epoch.
+        Batches contain whole multiples of the class ratio (so they may be slightly smaller than batch_size).
+        :param class_ratio: (positive, negative)
+        """
+        class_ratio_positive, class_ratio_negative = class_ratio
+        units = self.batch_size // (class_ratio_positive + class_ratio_negative)
+
+        if units > 0:
+            self.positive_in_batch = int(round(units * class_ratio_positive))
+            self.negative_in_batch = int(round(units * class_ratio_negative))
+        else:
+            # Ratio does not fit into batch
+            self.positive_in_batch = max(1, int(
+                class_ratio_positive * (self.batch_size / (class_ratio_positive + class_ratio_negative))))
+            self.negative_in_batch = self.batch_size - self.positive_in_batch
+
+        # Class without samples is not included in batches
+        if len(self.y_positive) == 0:
+            self.positive_in_batch = 0
+        if len(self.y_negative) == 0:
+            self.negative_in_batch = 0
+
+        self.class_ratio = class_ratio
+        self.on_epoch_end()
 
     def __len__(self):
         """
         Returns the total number of batches.
         """
-        return math.ceil((len(self.y_positive) + len(self.y_negative)) / self.batch_size)
+        if not self.shuffle:
+            return math.ceil((len(self.y_positive) + len(self.y_negative)) / self.batch_size)
+
+        return max(math.ceil(len(self.y_positive) / self.positive_in_batch) if self.positive_in_batch else 0,
+                   math.ceil(len(self.y_negative) / self.negative_in_batch) if self.negative_in_batch else 0)
+
+    def _get_order_(self, num_samples, num_needed):
+        """
+        Returns indices of samples for one epoch.
+        :param num_samples: number of samples of the class
+        :param num_needed: number of samples of the class used in the epoch
+        :return: ndarray of indices
+        """
+        if num_samples == 0:
+            return np.empty(0, dtype=np.int64)
+
+        permute = self.rng.permutation if self.shuffle else np.arange
+
+        if self.minority == "oversample":
+            order = permute(num_samples)[:num_needed]
+            missing = num_needed - len(order)
+            return np.concatenate([order, self.rng.integers(0, num_samples, size=missing)])
+
+        # cycle
+        return np.concatenate([permute(num_samples) for _ in range(math.ceil(num_needed / num_samples))])[:num_needed]
+
+    def on_epoch_end(self):
+        """
+        Creates sample order for a new epoch.
+        """
+        if not self.shuffle:
+            # Samples are read in order
+            return
+
+        num_batches = len(self)
+        self.positive_order = self._get_order_(len(self.y_positive), num_batches * self.positive_in_batch)
+        self.negative_order = self._get_order_(len(self.y_negative), num_batches * self.negative_in_batch)
 
     @staticmethod
     def __get_slice__(arr, idx, num):
         return arr[idx * num: (idx + 1) * num]
 
+    def _get_batch_indices_(self, idx):
+        """
+        Returns indices (arrays or slices) of positive and negative samples of batch idx.
+        """
+        if self.shuffle:
+            return (self.__get_slice__(self.positive_order, idx, self.positive_in_batch),
+                    self.__get_slice__(self.negative_order, idx, self.negative_in_batch))
+
+        # Each sample exactly once, positives followed by negatives
+        num_positive = len(self.y_positive)
+        start, end = idx * self.batch_size, (idx + 1) * self.batch_size
+
+        return (slice(min(start, num_positive), min(end, num_positive)),
+                slice(max(start - num_positive, 0), max(end - num_positive, 0)))
+
     def __getitem__(self, idx):
         """
         Returns one batch with positive and negative examples specified by
-        the "class_ratio".
+        the "class_ratio" (positive samples first, order of samples within a batch does not affect training).
         """
 
-        batch_x_positive = self.__get_slice__(self.x_positive, idx, self.positive_in_batch)
-        batch_y_positive = self.__get_slice__(self.y_positive, idx, self.positive_in_batch)
+        positive_idx, negative_idx = self._get_batch_indices_(idx)
+        num_positive = len(self.y_positive[positive_idx])
+        num_negative = len(self.y_negative[negative_idx])
 
-        batch_x_negative = self.__get_slice__(self.x_negative, idx, self.negative_in_batch)
-        batch_y_negative = self.__get_slice__(self.y_negative, idx, self.negative_in_batch)
+        # Gather samples directly into the batch
+        batch_x = np.empty((num_positive + num_negative,) + tuple(self.x_positive.shape[1:]),
+                           dtype=self.x_positive.dtype)
+        batch_x[:num_positive] = self.x_positive[positive_idx]
+        batch_x[num_positive:] = self.x_negative[negative_idx]
 
-        # Concat and shuffle samples
-        batch_x = np.concatenate([batch_x_positive, batch_x_negative], axis=0)
-        np.random.seed(idx)
-        np.random.shuffle(batch_x)
+        batch_y = np.empty(len(batch_x), dtype=np.result_type(self.y_positive, self.y_negative))
+        batch_y[:num_positive] = self.y_positive[positive_idx]
+        batch_y[num_positive:] = self.y_negative[negative_idx]
 
-        batch_y = np.concatenate([batch_y_positive, batch_y_negative], axis=0)
-        np.random.seed(idx)
-        np.random.shuffle(batch_y)
+        if self.transform is not None:
+            batch_x = self.transform(batch_x)
 
         return batch_x, batch_y
 
 
+class SequenceDataGenerator(BaseDataGenerator):
+    """
+    Data generator holding only the raw sequences as nucleotide codes (see encoders.functions.encode_sequences).
+    Interaction matrices are created for each batch in __getitem__, so memory does not depend on
+    the size of encoded tensors.
+    """
+
+    def __init__(self,
+                 x_set_positive, y_set_positive,
+                 x_set_negative, y_set_negative,
+                 class_ratio,
+                 batch_size,
+                 tensor_dim=(50, 26, 1),
+                 **kwargs):
+        super(SequenceDataGenerator, self).__init__(
+            x_set_positive, y_set_positive,
+            x_set_negative, y_set_negative,
+            class_ratio,
+            batch_size,
+            transform=functools.partial(expand_tensor, storage="sequence", tensor_dim=tensor_dim),
+            **kwargs)
+
+
+def expand_tensor_tf(x, storage="float32", tensor_dim=(50, 26, 1)):
+    """
+    TensorFlow version of encoders.functions.expand_tensor (usable in tf.data.Dataset.map).
+    """
+    if storage == "float32":
+        return x
+    elif storage == "uint8":
+        return tf.cast(x, tf.float32)
+    elif storage == "packed":
+        bits = tf.bitwise.bitwise_and(tf.bitwise.right_shift(x[..., None], tf.constant(np.arange(7, -1, -1), dtype=x.dtype)), 1)
+        bits = tf.reshape(bits, (tf.shape(x)[0], -1))[:, :int(np.prod(tensor_dim))]
+        return tf.cast(tf.reshape(bits, (-1,) + tuple(tensor_dim)), tf.float32)
+    elif storage == "sequence":
+        mrna, mirna = x[:, :tensor_dim[0]], x[:, tensor_dim[0]:]
+        pairs = tf.cast(tf.equal(mrna[:, :, None] + mirna[:, None, :], 5), tf.float32)[..., None]
+        return tf.pad(pairs, [[0, 0], [0, 0], [0, 0], [0, tensor_dim[2] - 1]])
+
+    raise ValueError(f"Unknown storage '{storage}'")
+
+
+def make_tf_dataset(x_positive, x_negative, class_ratio, batch_size,
+                    storage="float32", tensor_dim=(50, 26, 1), training=True, cache=False, seed=None):
+    """
+    Creates tf.data pipeline feeding samples to keras model.
+
+    With training=True, positive and negative samples are shuffled and drawn (sample_from_datasets) with
+    probabilities given by class_ratio. One epoch has as many samples as is needed to see each sample
+    of the larger class (relative to its share) once. Otherwise each sample is returned exactly once, in order.
+    Stored samples are expanded to float32 per batch by a parallel map.
+
+    :param x_positive: array of positive samples (in storage format)
+    :param x_negative: array of negative samples (in storage format)
+    :param class_ratio: (positive, negative)
+    :param batch_size: int
+    :param storage: storage format of x (see encoders.functions.compress_tensor)
+    :param tensor_dim: shape of the matrix of one sample
+    :param training: bool => sample by class_ratio and shuffle
+    :param cache: bool => cache expanded batches in memory (only with training=False)
+    :param seed: seed used for shuffling and sampling
+    :return: tf.data.Dataset of (x, y) batches
+    """
+    x_positive, x_negative = np.asarray(x_positive), np.asarray(x_negative)
+
+    positive = tf.data.Dataset.from_tensor_slices((x_positive, np.ones(len(x_positive), dtype="float32")))
+    negative = tf.data.Dataset.from_tensor_slices((x_negative, np.zeros(len(x_negative), dtype="float32")))
+
+    if training:
+        ratio_positive, ratio_negative = class_ratio
+        weight_positive = ratio_positive / (ratio_positive + ratio_negative)
+
+        num_samples = math.ceil(max(len(x_positive) / weight_positive if len(x_positive) else 0,
+                                    len(x_negative) / (1 - weight_positive) if len(x_negative) else 0))
+
+        positive = positive.shuffle(len(x_positive), seed=seed).repeat()
+        negative = negative.shuffle(len(x_negative), seed=seed).repeat()
+
+        dataset = tf.data.Dataset.sample_from_datasets([positive, negative],
+                                                       weights=[weight_positive, 1 - weight_positive],
+                                                       seed=seed).take(num_samples)
+    else:
+        dataset = positive.concatenate(negative)
+
+    dataset = dataset.batch(batch_size).map(
+        lambda x, y: (expand_tensor_tf(x, storage, tensor_dim), y),
+        num_parallel_calls=tf.data.AUTOTUNE)
+
+    if cache and not training:
+        dataset = dataset.cache()
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
 class BaseDataCreator:
     """
     This base class provides base methods for creating samples.
@@ -228,3 +436,211 @@ class BaseDataCreator:
             df.to_csv(path_or_buf=store_dataset, index=False)
 
         return df
+
+
+class VectorizedDataCreator(BaseDataCreator):
+    """
+    Data creator holding sequences as uint8 code arrays. All targets are created with whole-array
+    operations instead of per sample Python loops. Mutation modes and output columns are the same as
+    in BaseDataCreator.
+
+    miRNA table is processed in blocks of "block_size" rows, each block has its own random stream derived
+    from the creator's generator. Output for a given seed is therefore the same no matter if the dataset
+    is created at once, in chunks or by multiple processes.
+    """
+
+    max_mirna_len = 22
+
+    def __init__(self, rng=None, block_size=1024):
+        """
+        :param rng: numpy.random.Generator or seed used to create one (results are reproducible
+            for a given seed)
+        :param block_size: int => number of miRNAs sharing one random stream (unit of parallel work)
+        """
+        self.rng = np.random.default_rng(rng)
+        self.block_size = block_size
+
+    def get_modes(self, num_rows, mutation_mode=None):
+        """
+        Returns mode codes (indices into MUTATION_MODES) for each row of the miRNA table.
+        :param num_rows: int => number of miRNAs
+        :param mutation_mode: str => "positive_class", "negative_class" or None
+        :return: ndarray of mode codes
+        """
+        if mutation_mode == "negative_class":
+            return np.full(num_rows, MUTATION_MODES.index("noise"))
+        elif mutation_mode == "positive_class":
+            # 20% canonical_perfect, 30% canonical_20, 30% non_canonical, 20% noise
+            p = np.arange(num_rows) / num_rows * 100
+            return np.searchsorted([20, 50, 80], p, side='right')
+
+        return np.full(num_rows, MUTATION_MODES.index(None))
+
+    def create_samples(self, mirnas, modes, rng, n=1, target_len=50):
+        """
+        Creates N targets for each given miRNA.
+        :param mirnas: ndarray of miRNA sequences (not longer than max_mirna_len)
+        :param modes: ndarray of mode codes for each miRNA
+        :param rng: numpy.random.Generator
+        :param n: int => number of samples created from each mirna
+        :param target_len: int => len of output mrna target sequence
+        :return: dict with columns mirna, mrna, mutation, seed_start
+        """
+        mirna_codes, lengths = sequences_to_codes(mirnas, self.max_mirna_len)
+
+        # U => T
+        mirnas = codes_to_sequences(mirna_codes)
+
+        mirna_codes = np.repeat(mirna_codes, n, axis=0)
+        lengths = np.repeat(lengths, n)
+        modes = np.repeat(modes, n)
+
+        mutation_rate = get_mutation_rates(modes, rng, self.max_mirna_len)
+        mrna, seed_start = create_targets(mirna_codes, lengths, mutation_rate, rng, target_len=target_len)
+
+        return {
+            "mirna": np.repeat(mirnas, n),
+            "mrna": codes_to_sequences(mrna),
+            "mutation": np.array(MUTATION_MODES, dtype=object)[modes],
+            "seed_start": seed_start
+        }
+
+    def _prepare_(self, mirna_df, mutation_mode, mirna_column_name):
+        """
+        Returns miRNAs (U => T not replaced yet) not longer than max_mirna_len with their mode codes.
+        """
+        mirnas = mirna_df[mirna_column_name].to_numpy(dtype=str)
+        modes = self.get_modes(len(mirnas), mutation_mode)
+
+        # Longer miRNAs are skipped
+        keep = np.char.str_len(mirnas) <= self.max_mirna_len
+
+        return mirnas[keep], modes[keep]
+
+    def _blocks_(self, mirnas, modes, rng):
+        """
+        Splits miRNAs into blocks, each with its own seed derived from rng.
+        :return: generator of (mirnas, modes, numpy.random.SeedSequence)
+        """
+        entropy = int(rng.integers(2 ** 63))
+
+        for i, start in enumerate(range(0, max(len(mirnas), 1), self.block_size)):
+            yield (mirnas[start:start + self.block_size],
+                   modes[start:start + self.block_size],
+                   np.random.SeedSequence(entropy, spawn_key=(i,)))
+
+    def _map_blocks_(self, blocks, n, target_len, n_jobs):
+        """
+        Creates samples for each block, in order. If n_jobs is not 1, blocks are processed by a process pool.
+        :return: generator of dicts (see create_samples)
+        """
+        tasks = ((self, mirnas, modes, seed, n, target_len) for mirnas, modes, seed in blocks)
+
+        if n_jobs is None or n_jobs == 1:
+            yield from map(_create_block_samples_, tasks)
+        else:
+            with Pool(os.cpu_count() if n_jobs == -1 else n_jobs) as executor:
+                yield from executor.imap(_create_block_samples_, tasks)
+
+    @staticmethod
+    def _to_df_(outputs, include_mutation_mode, include_seed_start):
+        """
+        Concatenates outputs of create_samples into pandas.DataFrame.
+        """
+        output = {key: np.concatenate([o[key] for o in outputs]) for key in outputs[0].keys()}
+
+        if include_mutation_mode is False:
+            del output['mutation']
+        if include_seed_start is False:
+            del output['seed_start']
+
+        return pd.DataFrame(data=output)
+
+    def make_dataset(self,
+                     mirna_df=None,
+                     store_dataset=None,
+                     n=1,
+                     target_len=50,
+                     mutation_mode=None,
+                     include_mutation_mode=False,
+                     include_seed_start=False,
+                     mirna_column_name='Mature sequence',
+                     rng=None,
+                     n_jobs=None,
+                     **kwargs):
+        """
+        Go through input miRNA table and for each sequence based on given mode create N artificial targets.
+        Parameters are the same as for BaseDataCreator.make_dataset.
+
+        :param rng: numpy.random.Generator => overrides generator passed in constructor
+        :param n_jobs: int => number of processes used (-1 for all CPUs), output does not depend on it
+        :return: pandas.DataFrame
+        """
+
+        rng = self.rng if rng is None else rng
+
+        mirnas, modes = self._prepare_(mirna_df, mutation_mode, mirna_column_name)
+        outputs = list(self._map_blocks_(self._blocks_(mirnas, modes, rng), n, target_len, n_jobs))
+
+        df = self._to_df_(outputs, include_mutation_mode, include_seed_start)
+
+        if store_dataset is not None:
+            df.to_csv(path_or_buf=store_dataset, index=False)
+
+        return df
+
+    def iter_dataset(self,
+                     mirna_df=None,
+                     chunk_size=100000,
+                     n=1,
+                     target_len=50,
+                     mutation_mode=None,
+                     include_mutation_mode=False,
+                     include_seed_start=False,
+                     mirna_column_name='Mature sequence',
+                     rng=None,
+                     n_jobs=None,
+                     **kwargs):
+        """
+        Same as make_dataset, but yields the dataset in chunks so that the whole dataset is never held
+        in memory. Each chunk contains all samples of whole blocks of miRNAs.
+
+        :param chunk_size: int => maximal number of samples in a chunk (at least n * block_size)
+        :return: generator of pandas.DataFrame
+        """
+
+        rng = self.rng if rng is None else rng
+
+        mirnas, modes = self._prepare_(mirna_df, mutation_mode, mirna_column_name)
+        blocks_in_chunk = max(1, chunk_size // (n * self.block_size))
+
+        outputs = []
+        for output in self._map_blocks_(self._blocks_(mirnas, modes, rng), n, target_len, n_jobs):
+            outputs.append(output)
+
+            if len(outputs) == blocks_in_chunk:
+                yield self._to_df_(outputs, include_mutation_mode, include_seed_start)
+                outputs = []
+
+        if outputs:
+            yield self._to_df_(outputs, include_mutation_mode, include_seed_start)
+
+    def stream_dataset(self, store_dataset, chunk_size=100000, **kwargs):
+        """
+        Creates dataset chunk by chunk and appends each chunk to store_dataset (see store_chunks for
+        supported formats).
+
+        :param store_dataset: str => path of the output file (directory for .npy shards)
+        :param chunk_size: int => maximal number of samples in a chunk
+        :param kwargs: same as for iter_dataset
+        :return: int => number of stored samples
+        """
+        return store_chunks(self.iter_dataset(chunk_size=chunk_size, **kwargs), store_dataset)
+
+
+def _create_block_samples_(task):
+    """
+    Helper function for (parallel) processing of one block of VectorizedDataCreator.
+    """
+    creator, mirnas, modes, seed, n, target_len = task
+    return creator.create_samples(mirnas, modes, np.random.default_rng(seed), n=n, target_len=target_len)
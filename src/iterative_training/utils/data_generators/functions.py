@@ -0,0 +1,204 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Mutation modes, the index of each mode is used as its code in the vectorized functions.
+# The last entry (None) reproduces BaseDataCreator behaviour when no mutation_mode is given.
+MUTATION_MODES = ("canonical_perfect", "canonical_20", "non_canonical", "noise", None)
+
+# Nucleotide codes: A=0, C=1, G=2, T=3 => complement of a code is (3 - code), padding is 255
+ALPHABET = np.zeros(256, dtype=np.uint8)
+ALPHABET[:4] = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+NUCLEOTIDE_CODES = np.full(256, 255, dtype=np.uint8)
+for _code, _nt in enumerate(b"ACGT"):
+    NUCLEOTIDE_CODES[_nt] = _code
+    NUCLEOTIDE_CODES[ord(chr(_nt).lower())] = _code
+NUCLEOTIDE_CODES[ord("U")] = NUCLEOTIDE_CODES[ord("u")] = 3
+
+
+def sequences_to_codes(sequences, length=22):
+    """
+    Converts sequences to an array of nucleotide codes (A=0, C=1, G=2, T/U=3), padded with 255.
+
+    :param sequences: iterable of str
+    :param length: int => width of output array, longer sequences are truncated
+    :return: (ndarray uint8 of shape (N, length), ndarray of sequence lengths)
+    """
+    sequences = np.asarray(sequences, dtype=f"S{length}")
+    raw = np.frombuffer(sequences.tobytes(), dtype=np.uint8).reshape(len(sequences), length)
+    codes = NUCLEOTIDE_CODES[raw]
+    codes[raw == 0] = 255
+    lengths = (raw != 0).sum(axis=1)
+    return codes, lengths
+
+
+def codes_to_sequences(codes):
+    """
+    Converts an array of nucleotide codes of shape (N, L) back to an array of N strings (padding is removed).
+    """
+    codes = np.ascontiguousarray(codes)
+    raw = ALPHABET[codes]
+    return raw.view(f"S{codes.shape[1]}").ravel().astype(str)
+
+
+def get_mutation_rates(modes, rng, length=22):
+    """
+    Vectorized version of BaseDataCreator.get_mutation_rate.
+
+    :param modes: ndarray of mode codes (indices into MUTATION_MODES)
+    :param rng: numpy.random.Generator
+    :param length: int => length of mutation rate array (max miRNA length)
+    :return: ndarray of shape (N, length) with probabilities of mutation
+    """
+    n = len(modes)
+    positions = np.arange(length)
+    mutation_rate = np.ones((n, length))
+
+    seed_region = (positions >= 2) & (positions < 8)
+    mutation_rate[(modes == 0)[:, None] & seed_region] = 0
+    mutation_rate[(modes == 1)[:, None] & seed_region] = 0.2
+
+    # non_canonical - 4 nt at 0% from random start in [0, 6], 4-6 nt at 20% from random end in [12, 15]
+    start = rng.integers(0, 7, size=n)[:, None]
+    end = rng.integers(12, 16, size=n)[:, None]
+    end_len = rng.integers(4, 7, size=n)[:, None]
+
+    non_canonical = (modes == 2)[:, None]
+    mutation_rate[non_canonical & (positions >= start) & (positions < start + 4)] = 0
+    mutation_rate[non_canonical & (positions >= end) & (positions < end + end_len)] = 0.2
+
+    return mutation_rate
+
+
+def create_targets(mirna_codes, lengths, mutation_rate, rng, target_len=50):
+    """
+    Vectorized version of BaseDataCreator.create_target. Creates one target per row of mirna_codes.
+
+    :param mirna_codes: ndarray (N, L) of nucleotide codes
+    :param lengths: ndarray (N,) of miRNA lengths
+    :param mutation_rate: ndarray (N, L) with probabilities of mutation
+    :param rng: numpy.random.Generator
+    :param target_len: int => length of generated target mRNA
+    :return: (ndarray (N, target_len) of mRNA codes, ndarray (N,) of seed starts)
+    """
+    n, length = mirna_codes.shape
+    lengths = np.asarray(lengths)
+
+    # Mutate - substitute nucleotide with one of the other three
+    mutate = rng.integers(0, 101, size=(n, length)) / 100 <= mutation_rate
+    shift = rng.integers(1, 4, size=(n, length), dtype=np.uint8)
+    mutated = np.where(mutate, (mirna_codes + shift) % 4, mirna_codes)
+
+    # Reverse complement
+    reverse_idx = lengths[:, None] - 1 - np.arange(length)
+    site = 3 - np.take_along_axis(mutated, np.clip(reverse_idx, 0, length - 1), axis=1)
+
+    # Place the site into a random sequence at random point
+    flank = rng.integers(0, 4, size=(n, target_len), dtype=np.uint8)
+    random_point = rng.integers(0, target_len - lengths + 1)
+
+    positions = np.arange(target_len)
+    relative = positions - random_point[:, None]
+    in_site = (relative >= 0) & (relative < lengths[:, None])
+    flank_idx = np.where(relative < 0, positions, positions - lengths[:, None])
+
+    mrna = np.where(in_site,
+                    np.take_along_axis(site, np.clip(relative, 0, length - 1), axis=1),
+                    np.take_along_axis(flank, np.clip(flank_idx, 0, target_len - 1), axis=1))
+
+    return mrna.astype(np.uint8), random_point
+
+
+def store_chunks(chunks, path):
+    """
+    Appends chunks of dataset to disk one by one, so only a single chunk is held in memory. Format
+    is chosen based on the path:
+        - *.csv - chunks are appended to a single csv file
+        - *.parquet - each chunk is stored as a row group (requires pyarrow)
+        - other - path is a directory, each chunk is stored as a .npy shard (structured array)
+
+    :param chunks: iterable of pandas.DataFrame
+    :param path: str => output path
+    :return: int => number of stored rows
+    """
+
+    num_rows = 0
+    writer = None
+
+    if not path.endswith((".csv", ".parquet")):
+        os.makedirs(path, exist_ok=True)
+
+    try:
+        for i, df in enumerate(chunks):
+            if path.endswith(".csv"):
+                df.to_csv(path_or_buf=path, index=False, mode="w" if i == 0 else "a", header=i == 0)
+
+            elif path.endswith(".parquet"):
+                pa, pq = _import_pyarrow_()
+
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+
+            else:
+                np.save(os.path.join(path, f"chunk_{i:05d}.npy"), df_to_records(df))
+
+            num_rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return num_rows
+
+
+def load_chunks(path, chunk_size=100000):
+    """
+    Lazily reads dataset stored by store_chunks.
+
+    :param path: str => path used with store_chunks
+    :param chunk_size: int => number of rows in a chunk (only used for csv files)
+    :return: generator of pandas.DataFrame
+    """
+
+    if path.endswith(".csv"):
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+    elif path.endswith(".parquet"):
+        _, pq = _import_pyarrow_()
+
+        parquet_file = pq.ParquetFile(path)
+        for i in range(parquet_file.num_row_groups):
+            yield parquet_file.read_row_group(i).to_pandas()
+
+    else:
+        for file_name in sorted(os.listdir(path)):
+            if file_name.endswith(".npy"):
+                yield pd.DataFrame(np.load(os.path.join(path, file_name), mmap_mode="r"))
+
+
+def _import_pyarrow_():
+    """
+    Imports pyarrow, which is only needed for parquet files (optional dependency - "parquet" extra).
+    :return: (pyarrow, pyarrow.parquet)
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet files require pyarrow (pip install iterative-training-pkg-janowie[parquet]), "
+                          "store chunks to a .csv file or a directory of .npy shards instead") from e
+
+    return pa, pq
+
+
+def df_to_records(df):
+    """
+    Converts DataFrame to a structured array with fixed width string fields (no pickled objects).
+    """
+    columns = [df[c].to_numpy(dtype=str) if df[c].dtype == object or isinstance(df[c].dtype, pd.StringDtype)
+               else df[c].to_numpy() for c in df.columns]
+    return np.rec.fromarrays(columns, names=list(df.columns))
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 import random
 import numpy as np
@@ -5,7 +7,9 @@ import numpy as np
 # Import tested class
 import pandas as pd
 
-from ..data_generators.base import BaseDataGenerator, BaseDataCreator
+from ..data_generators.base import BaseDataGenerator, BaseDataCreator, VectorizedDataCreator, SequenceDataGenerator
+from ..encoders.functions import encode_sequences, encode_ohe_matrix_2d_batch
+from ..data_generators.functions import load_chunks
 
 
 class TestDataGen(unittest.TestCase):
@@ -37,6 +41,58 @@ class TestDataGen(unittest.TestCase):
 
         self.assertEqual(num_positive * self.ratio[1], num_negative * self.ratio[0])
 
+    def test_epoch_covers_all_samples(self):
+        data_gen = BaseDataGenerator(np.arange(7), np.ones(7), np.arange(100, 140), np.zeros(40), (1, 4), 10, seed=0)
+
+        epochs = []
+        for _ in range(2):
+            batches = [data_gen.__getitem__(i)[0] for i in range(len(data_gen))]
+            epochs.append(np.concatenate(batches))
+            data_gen.on_epoch_end()
+
+        # Every negative sample is used once, positive samples are cycled
+        with self.subTest():
+            self.assertListEqual(sorted(epochs[0][epochs[0] >= 100]), list(range(100, 140)))
+        with self.subTest():
+            self.assertSetEqual(set(epochs[0][epochs[0] < 100]), set(range(7)))
+        with self.subTest():
+            self.assertTrue(all(len(batch) == 10 for batch in batches))
+
+        # New order in the next epoch
+        with self.subTest():
+            self.assertFalse(np.array_equal(epochs[0], epochs[1]))
+
+    def test_evaluation_covers_each_sample_once(self):
+        # Class sizes do not match class ratio (e.g. after the ratio was lowered)
+        data_gen = BaseDataGenerator(np.arange(7), np.ones(7), np.arange(100, 140), np.zeros(40), (1, 1), 10,
+                                     shuffle=False)
+
+        batches = [data_gen.__getitem__(i) for i in range(len(data_gen))]
+
+        with self.subTest():
+            np.testing.assert_array_equal(np.concatenate([x for x, _ in batches]),
+                                          np.concatenate([np.arange(7), np.arange(100, 140)]))
+
+        with self.subTest():
+            np.testing.assert_array_equal(np.concatenate([y for _, y in batches]), [1] * 7 + [0] * 40)
+
+
+class TestSequenceDataGen(unittest.TestCase):
+
+    def test_batches_are_encoded_on_the_fly(self):
+        df = VectorizedDataCreator(rng=1).make_dataset(
+            mirna_df=pd.DataFrame(data={"Mature sequence": ["UGAGGUAGUAGGUUGUAUAGUU", "UAGCAGCACGUAAAUAUUGGCG"]}),
+            n=16)
+        codes = encode_sequences(df)
+
+        data_gen = SequenceDataGenerator(codes, np.ones(len(codes)), codes, np.zeros(len(codes)), (1, 1), 8,
+                                         shuffle=False)
+        batch_x, _ = data_gen.__getitem__(0)
+
+        expected = encode_ohe_matrix_2d_batch(df)
+        # Without shuffling, samples are returned in order (first batch contains the first 8 positive samples)
+        np.testing.assert_array_equal(batch_x, expected[:8])
+
 
 class TestDataCreation(unittest.TestCase):
 
@@ -74,3 +130,75 @@ class TestDataCreation(unittest.TestCase):
 
         with self.subTest():
             self.assertAlmostEqual(counts.loc["canonical_20"]["mirna"], 3000, delta=10)
+
+
+class TestVectorizedDataCreation(unittest.TestCase):
+
+    df_mirna = pd.DataFrame(data={
+        "Mature sequence": ["UGAGGUAGUAGGUUGUAUAGUU", "CUAUACGACCUGCUGCCUUUCUUAG", "UAGCAGCACGUAAAUAUUGGCG",
+                            "AAAGUGCUUACAGUGCAGGUAG", "UGUAAACAUCCUACACUCUCAGC", "UCCCUGAGACCCUUUAACCUGUGA"]
+    })
+
+    def test_output_columns_and_length(self):
+        df = VectorizedDataCreator(rng=42).make_dataset(mirna_df=self.df_mirna, n=10, target_len=50,
+                                                       mutation_mode="positive_class",
+                                                       include_mutation_mode=True, include_seed_start=True)
+
+        # Sequences longer than 22 nt are skipped
+        with self.subTest():
+            self.assertEqual(len(df), 30)
+
+        with self.subTest():
+            self.assertListEqual(list(df.columns), ["mirna", "mrna", "mutation", "seed_start"])
+
+        with self.subTest():
+            self.assertTrue((df["mrna"].str.len() == 50).all())
+
+    def test_seed_is_reproducible(self):
+        kwargs = dict(mirna_df=self.df_mirna, n=5, mutation_mode="negative_class", include_seed_start=True)
+
+        df_a = VectorizedDataCreator(rng=7).make_dataset(**kwargs)
+        df_b = VectorizedDataCreator(rng=7).make_dataset(**kwargs)
+
+        self.assertTrue(df_a.equals(df_b))
+
+    def test_canonical_perfect_keeps_seed(self):
+        df = VectorizedDataCreator(rng=0).make_dataset(mirna_df=self.df_mirna.iloc[:1], n=100,
+                                                      mutation_mode="positive_class",
+                                                      include_seed_start=True)
+        complement = str.maketrans("ACGT", "TGCA")
+
+        # Seed of the (reverse complement) site matches miRNA positions 2-7 in most of the targets
+        matches = 0
+        for _, row in df.iterrows():
+            site = row["mrna"][row["seed_start"]:row["seed_start"] + len(row["mirna"])]
+            matches += site.translate(complement)[::-1][2:8] == row["mirna"][2:8]
+
+        self.assertGreater(matches, 80)
+
+    def test_stream_dataset(self):
+        creator = VectorizedDataCreator(rng=3, block_size=1)
+        expected = VectorizedDataCreator(rng=3, block_size=1).make_dataset(mirna_df=self.df_mirna, n=4, include_seed_start=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for path in ["dataset.csv", "shards"]:
+                path = os.path.join(directory, path)
+                creator.rng = np.random.default_rng(3)
+
+                num_rows = creator.stream_dataset(path, chunk_size=4, mirna_df=self.df_mirna, n=4,
+                                                  include_seed_start=True)
+                chunks = list(load_chunks(path, chunk_size=4))
+                df = pd.concat(chunks, ignore_index=True)
+
+                with self.subTest(path=path):
+                    self.assertEqual(num_rows, len(expected))
+                    self.assertEqual(len(chunks), 3)
+                    self.assertTrue(df.equals(expected))
+
+    def test_parallel_is_reproducible(self):
+        kwargs = dict(mirna_df=self.df_mirna, n=5, mutation_mode="positive_class", include_mutation_mode=True)
+
+        df_serial = VectorizedDataCreator(rng=11, block_size=2).make_dataset(**kwargs)
+        df_parallel = VectorizedDataCreator(rng=11, block_size=2).make_dataset(n_jobs=2, **kwargs)
+
+        self.assertTrue(df_serial.equals(df_parallel))
@@ -3,42 +3,122 @@ import numpy as np
 import pandas as pd
 
 # Custom functions
-from .functions import encode_ohe_matrix_2d
+from .functions import encode_ohe_matrix_2d, encode_ohe_matrix_2d_batch
 
 
 class BaseEncoder:
 
     """
-    The base encoder class
+    The base encoder class. Worker processes of the pool are kept between encode calls until close is called
+    (or the encoder is used as a context manager), samplers close the pool after encoding their datasets.
     """
 
-    def __init__(self, func=encode_ohe_matrix_2d, tensor_dim=(50, 26, 1)):
+    def __init__(self, func=encode_ohe_matrix_2d, tensor_dim=(50, 26, 1), processes=None, chunk_size=2048):
+        """
+        :param func: function encoding one row => func((index, row), tensor_dim=...), row supports row['mrna']
+        :param tensor_dim: shape of the matrix of one sample
+        :param processes: number of worker processes (None => all CPUs)
+        :param chunk_size: number of rows sent to a worker at once, smaller inputs are encoded in this process
+        """
         self.tensor_dim = tensor_dim
         self.func = func
+        self.processes = processes
+        self.chunk_size = chunk_size
+
+        # Process pool is created on first use and reused by following calls
+        self.pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
 
-    def __call_func__(self, x: pd.Series):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
         """
-        Helper function to call the "encoding function" supplied with the "tensor_dim" param.
-        :param x: df row
-        :return: ndarray
+        Terminates the worker processes (a new pool is created if encode is called again).
         """
-        return self.func(x, tensor_dim=self.tensor_dim)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
 
     def encode(self, df: pd.DataFrame):
         """
-        Applies func to given df. Uses maximal number of processes available.
+        Applies func to given df. Rows are sent to the (persistent) process pool in chunks of columns.
         :param df: pandas DataFrame to be encoded by func
         :return: ndarray (with encoded df)
         """
 
-        with Pool() as executor:
+        columns = {column: df[column].to_numpy() for column in df.columns}
+        chunks = [({column: values[start:start + self.chunk_size] for column, values in columns.items()},
+                   df.index[start:start + self.chunk_size])
+                  for start in range(0, len(df), self.chunk_size)]
+        tasks = [(self.func, self.tensor_dim, chunk, index) for chunk, index in chunks]
+
+        if len(tasks) > 1:
+            if self.pool is None:
+                self.pool = Pool(self.processes)
+            results = self.pool.map(_encode_chunk_, tasks)
+        else:
+            results = list(map(_encode_chunk_, tasks))
 
-            ohe_matrix = []
+        ohe_matrix = np.empty((len(df),) + tuple(self.tensor_dim), dtype="float32")
+        keep = np.ones(len(df), dtype=bool)
+
+        start = 0
+        for block, block_keep in results:
+            ohe_matrix[start:start + len(block)] = block
+            keep[start:start + len(block)] = block_keep
+            start += len(block)
+
+        # Rows for which func returned None are skipped
+        if not keep.all():
+            ohe_matrix = ohe_matrix[keep]
+
+        return ohe_matrix
+
+
+def _encode_chunk_(task):
+    """
+    Encodes a chunk of rows into a pre-allocated block (runs in worker processes).
+    :param task: (func, tensor_dim, dict of column arrays, index)
+    :return: (block of encoded rows, boolean mask of rows for which func did not return None)
+    """
+    func, tensor_dim, columns, index = task
 
-            # execute tasks concurrently and process results in order
-            for result in executor.map(self.__call_func__, df.iterrows()):
-                # report the result
-                if result is not None:
-                    ohe_matrix.append(result)
+    block = np.zeros((len(index),) + tuple(tensor_dim), dtype="float32")
+    keep = np.ones(len(index), dtype=bool)
 
-        return np.stack(ohe_matrix, axis=0)
+    for i, idx in enumerate(index):
+        result = func((idx, {column: values[i] for column, values in columns.items()}), tensor_dim=tensor_dim)
+
+        if result is None:
+            keep[i] = False
+        else:
+            block[i] = result
+
+    return block, keep
+
+
+class VectorizedEncoder(BaseEncoder):
+
+    """
+    Encoder computing interaction matrices for the whole DataFrame with array operations (no process pool).
+    """
+
+    def __init__(self, func=encode_ohe_matrix_2d_batch, tensor_dim=(50, 26, 1), **kwargs):
+        super(VectorizedEncoder, self).__init__(func=func, tensor_dim=tensor_dim, **kwargs)
+
+    def encode(self, df: pd.DataFrame):
+        """
+        Applies func to the whole df.
+        :param df: pandas DataFrame with columns "mrna" and "mirna"
+        :return: ndarray (with encoded df)
+        """
+        return self.func(df, tensor_dim=self.tensor_dim)
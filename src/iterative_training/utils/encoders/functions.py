@@ -1,5 +1,7 @@
 import numpy as np
 
+from ..data_generators.functions import NUCLEOTIDE_CODES
+
 
 # TODO: proper documentation and typing hints!
 def encode_ohe_matrix_2d(row, tensor_dim=(50, 26, 1)):  # , categories=False
@@ -35,3 +37,150 @@ def encode_ohe_matrix_2d(row, tensor_dim=(50, 26, 1)):  # , categories=False
             ohe_matrix_2d[bind_index, mirna_index, 0] = alphabet.get(base_pairs, 0)
 
     return ohe_matrix_2d
+
+
+# Pair codes used for the vectorized encoding - NUCLEOTIDE_CODES shifted by one: A=1, C=2, G=3, T=4, anything
+# else (padding) 0. Watson-Crick pairs (A-T, C-G) are exactly the pairs of codes summing up to 5.
+# U is not paired, same as in encode_ohe_matrix_2d.
+_PAIR_CODES = NUCLEOTIDE_CODES + np.uint8(1)
+_PAIR_CODES[[ord("U"), ord("u")]] = 0
+
+
+def sequences_to_pair_codes(sequences, length):
+    """
+    Maps sequences to an array of pair codes (see _PAIR_CODES) padded with zeros.
+
+    :param sequences: iterable of str (not longer than length)
+    :param length: int => width of output array
+    :return: ndarray uint8 of shape (N, length)
+    """
+    sequences = np.asarray(sequences, dtype=f"S{length}")
+    raw = np.frombuffer(sequences.tobytes(), dtype=np.uint8).reshape(len(sequences), length)
+    return _PAIR_CODES[raw]
+
+
+def encode_codes_2d(mrna_codes, mirna_codes, tensor_dim=(50, 26, 1)):
+    """
+    Computes watson-crick interaction matrices for a batch of sequences with one broadcasted comparison.
+
+    :param mrna_codes: ndarray uint8 of shape (N, tensor_dim[0]) - see sequences_to_pair_codes
+    :param mirna_codes: ndarray uint8 of shape (N, tensor_dim[1]) - see sequences_to_pair_codes
+    :param tensor_dim: shape of the matrix of one sample
+    :return: ndarray float32 of shape (N, *tensor_dim)
+    """
+    ohe_matrix_2d = np.zeros((len(mrna_codes),) + tuple(tensor_dim), dtype="float32")
+    ohe_matrix_2d[..., 0] = (mrna_codes[:, :, None] + mirna_codes[:, None, :]) == 5
+    return ohe_matrix_2d
+
+
+def fits_tensor_dim(df, tensor_dim=(50, 26, 1)):
+    """
+    Returns mask of rows of df which can be encoded - encoders skip rows with sequences longer than tensor_dim allows.
+
+    :param df: pandas DataFrame with columns "mrna" and "mirna"
+    :param tensor_dim: shape of the matrix of one sample
+    :return: ndarray bool of shape (N,)
+    """
+    mrna = df['mrna'].to_numpy(dtype=str)
+    mirna = df['mirna'].to_numpy(dtype=str)
+
+    return (np.char.str_len(mrna) <= tensor_dim[0]) & (np.char.str_len(mirna) <= tensor_dim[1])
+
+
+def _filter_long_sequences_(df, tensor_dim):
+    """
+    Returns mrna and mirna arrays of df without rows with sequences longer than tensor_dim allows.
+    """
+    mrna = df['mrna'].to_numpy(dtype=str)
+    mirna = df['mirna'].to_numpy(dtype=str)
+
+    # Check if input sequences have the expected length
+    keep = fits_tensor_dim(df, tensor_dim)
+    if not keep.all():
+        print(f"{np.count_nonzero(~keep)} rows skipped, sequences longer than {tensor_dim[0]}, {tensor_dim[1]}")
+        mrna, mirna = mrna[keep], mirna[keep]
+
+    return mrna, mirna
+
+
+def encode_sequences(df, tensor_dim=(50, 26, 1)):
+    """
+    Encodes mrna and mirna of df to nucleotide codes, ~70x smaller than the interaction matrices.
+    Use encode_sequence_codes to create the matrices.
+
+    :param df: pandas DataFrame with columns "mrna" and "mirna"
+    :param tensor_dim: shape of the matrix of one sample
+    :return: ndarray uint8 of shape (N, tensor_dim[0] + tensor_dim[1]), rows with too long sequences are skipped
+    """
+    mrna, mirna = _filter_long_sequences_(df, tensor_dim)
+    return np.concatenate([sequences_to_pair_codes(mrna, tensor_dim[0]),
+                           sequences_to_pair_codes(mirna, tensor_dim[1])], axis=1)
+
+
+def encode_sequence_codes(codes, tensor_dim=(50, 26, 1)):
+    """
+    Creates interaction matrices from output of encode_sequences.
+    :return: ndarray float32 of shape (N, *tensor_dim)
+    """
+    return encode_codes_2d(codes[:, :tensor_dim[0]], codes[:, tensor_dim[0]:], tensor_dim)
+
+
+def encode_ohe_matrix_2d_batch(df, tensor_dim=(50, 26, 1), batch_size=4096):
+    """
+    Vectorized version of encode_ohe_matrix_2d, encodes all rows of df at once.
+
+    :param df: pandas DataFrame with columns "mrna" and "mirna"
+    :param tensor_dim: shape of the matrix of one sample
+    :param batch_size: number of rows encoded at once (bounds the size of temporary arrays)
+    :return: ndarray float32 of shape (N, *tensor_dim), rows with too long sequences are skipped
+    """
+    mrna, mirna = _filter_long_sequences_(df, tensor_dim)
+
+    ohe_matrix_2d = np.empty((len(mrna),) + tuple(tensor_dim), dtype="float32")
+
+    for start in range(0, len(mrna), batch_size):
+        end = start + batch_size
+        ohe_matrix_2d[start:end] = encode_codes_2d(sequences_to_pair_codes(mrna[start:end], tensor_dim[0]),
+                                                   sequences_to_pair_codes(mirna[start:end], tensor_dim[1]),
+                                                   tensor_dim)
+
+    return ohe_matrix_2d
+
+
+def compress_tensor(x, storage="float32"):
+    """
+    Converts encoded (binary) tensors to a compact representation for storing.
+
+    :param x: ndarray of shape (N, *tensor_dim) with values 0 / 1
+    :param storage: one of
+        - float32 - no conversion
+        - uint8 - one byte per value (4x smaller)
+        - packed - one bit per value, bits of each sample are packed along the last axis (32x smaller)
+    :return: ndarray
+    """
+    if storage == "float32":
+        return x
+    elif storage == "uint8":
+        return x.astype(np.uint8)
+    elif storage == "packed":
+        return np.packbits(x.reshape(len(x), int(np.prod(x.shape[1:]))).astype(bool), axis=1)
+
+    raise ValueError(f"Unknown storage '{storage}'")
+
+
+def expand_tensor(x, storage="float32", tensor_dim=(50, 26, 1)):
+    """
+    Inverse of compress_tensor, returns float32 tensors of shape (N, *tensor_dim). With storage "sequence",
+    x is output of encode_sequences and matrices are created from it.
+    """
+    if storage == "float32":
+        return x
+    elif storage == "uint8":
+        return x.astype("float32")
+    elif storage == "packed":
+        x = np.unpackbits(x, axis=1, count=int(np.prod(tensor_dim)))
+        return x.reshape((len(x),) + tuple(tensor_dim)).astype("float32")
+    elif storage == "sequence":
+        return encode_sequence_codes(x, tensor_dim)
+
+    raise ValueError(f"Unknown storage '{storage}'")
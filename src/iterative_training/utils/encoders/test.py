@@ -3,7 +3,8 @@ import random
 import pandas as pd
 import numpy as np
 
-from .base import BaseEncoder
+from .base import BaseEncoder, VectorizedEncoder
+from .functions import compress_tensor, expand_tensor
 
 
 class EncoderTester(unittest.TestCase):
@@ -29,3 +30,48 @@ class EncoderTester(unittest.TestCase):
         test_data = self.generate_dummy_df()
         data = self.encoder.encode(test_data)
         self.assertEqual(self.output_shape, data.shape)
+
+    def test_vectorized_matches_base_encoder(self):
+        test_data = self.generate_dummy_df()
+        test_data.loc[0, "mirna"] = test_data.loc[0, "mirna"][:20]
+
+        expected = self.encoder.encode(test_data)
+        data = VectorizedEncoder().encode(test_data)
+
+        with self.subTest():
+            self.assertEqual(expected.dtype, data.dtype)
+
+        with self.subTest():
+            np.testing.assert_array_equal(expected, data)
+
+    def test_compact_storage_round_trip(self):
+        data = VectorizedEncoder().encode(self.generate_dummy_df())
+
+        for storage in ["float32", "uint8", "packed"]:
+            stored = compress_tensor(data, storage)
+
+            with self.subTest(storage=storage):
+                np.testing.assert_array_equal(expand_tensor(stored, storage, (50, 26, 1)), data)
+
+    def test_process_pool_matches_vectorized(self):
+        test_data = self.generate_dummy_df()
+        # Too long sequence in the middle of a chunk is skipped
+        test_data.loc[3, "mrna"] = test_data.loc[3, "mrna"] * 2
+
+        expected = VectorizedEncoder().encode(test_data)
+
+        with BaseEncoder(processes=2, chunk_size=16) as encoder:
+            data = encoder.encode(test_data)
+            data_again = encoder.encode(test_data)
+
+            with self.subTest():
+                self.assertIsNotNone(encoder.pool)
+
+        with self.subTest():
+            self.assertIsNone(encoder.pool)
+
+        with self.subTest():
+            np.testing.assert_array_equal(expected, data)
+
+        with self.subTest():
+            np.testing.assert_array_equal(data, data_again)
@@ -0,0 +1,133 @@
+import numpy as np
+
+
+def predict_batches(model, x_positive, x_negative, batch_size=256, transform=None):
+    """
+    Predicts negative and positive samples batch by batch into a preallocated buffer, so that neither the whole
+    dataset nor its expanded (float32) version is ever concatenated.
+
+    :param model: keras model with a single output
+    :param x_positive: array of positive samples (in storage format)
+    :param x_negative: array of negative samples (in storage format)
+    :param batch_size: int
+    :param transform: function applied to x of each batch (e.g. sampler.expand)
+    :return: (labels, scores) ndarrays - negative samples first
+    """
+    num_negative = len(x_negative)
+    scores = np.empty(num_negative + len(x_positive), dtype=np.float32)
+
+    labels = np.zeros(len(scores), dtype=np.int8)
+    labels[num_negative:] = 1
+
+    for offset, x in ((0, x_negative), (num_negative, x_positive)):
+        for start in range(0, len(x), batch_size):
+            batch = x[start:start + batch_size]
+            if transform is not None:
+                batch = transform(batch)
+
+            scores[offset + start:offset + start + len(batch)] = np.asarray(model.predict_on_batch(batch)).reshape(-1)
+
+    return labels, scores
+
+
+def predict_datagen(model, datagen, batch_size=256):
+    """
+    Predicts all samples of a data generator once. Samples of BaseDataGenerator are read from its arrays (batches
+    of the generator may repeat samples to keep class ratio), other iterables (e.g. tf.data.Dataset) are predicted
+    batch by batch.
+
+    :return: (labels, scores) ndarrays
+    """
+    if hasattr(datagen, "x_positive"):
+        return predict_batches(model, datagen.x_positive, datagen.x_negative, batch_size, transform=datagen.transform)
+
+    labels, scores = [], []
+    for x, y in datagen:
+        labels.append(np.asarray(y).reshape(-1))
+        scores.append(np.asarray(model.predict_on_batch(x)).reshape(-1))
+
+    return np.concatenate(labels).astype(np.int8), np.concatenate(scores)
+
+
+def downsample_curve(x, y, num_points=500):
+    """
+    Returns at most num_points points of curve (x, y), spread evenly over its points, end points are always kept.
+
+    :param x: ndarray
+    :param y: ndarray of the same length as x
+    :param num_points: int >= 2
+    :return: (x, y) ndarrays
+    """
+    if len(x) <= num_points:
+        return x, y
+
+    idx = np.unique(np.linspace(0, len(x) - 1, num_points).round().astype(np.int64))
+    return x[idx], y[idx]
+
+
+def evaluate_predictions(labels, scores, threshold=0.5, drop_intermediate=True):
+    """
+    Computes thresholded metrics, ROC and precision-recall curves and areas under them with a single sort of scores.
+
+    :param labels: ndarray of 0 / 1 labels
+    :param scores: ndarray of predicted probabilities
+    :param threshold: float => samples with score >= threshold are predicted as positive
+    :param drop_intermediate: if True, points of the ROC curve lying on a straight line between their neighbours
+        are dropped (as in sklearn.metrics.roc_curve), areas are computed from the full curves
+    :return: dict
+    """
+    labels = np.asarray(labels).reshape(-1)
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+
+    order = np.argsort(-scores, kind="mergesort")
+    sorted_scores, sorted_labels = scores[order], labels[order]
+
+    # Cumulative counts at each distinct threshold (last sample of each run of equal scores)
+    last = np.r_[np.flatnonzero(np.diff(sorted_scores)), len(scores) - 1]
+    tps = np.cumsum(sorted_labels)[last].astype(np.float64)
+    fps = (last + 1) - tps
+
+    num_positive, num_negative = labels.sum(), len(labels) - labels.sum()
+
+    tpr = np.r_[0, tps / num_positive] if num_positive else np.full(len(tps) + 1, np.nan)
+    fpr = np.r_[0, fps / num_negative] if num_negative else np.full(len(fps) + 1, np.nan)
+    precision_curve = np.r_[1, tps / (tps + fps)]
+
+    roc_auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+    average_precision = float(np.sum(np.diff(tpr) * precision_curve[1:]))
+    recall_curve = tpr
+    thresholds = np.r_[np.inf, sorted_scores[last]]
+
+    if drop_intermediate and len(tps) > 2:
+        # Keep end points and points where the slope changes, plus the (0, 0) point
+        keep = np.r_[True, True, np.logical_or(np.diff(fps, 2), np.diff(tps, 2)), True]
+        fpr, tpr, thresholds = fpr[keep], tpr[keep], thresholds[keep]
+
+    # Thresholded metrics from the same counts
+    num_predicted = np.searchsorted(-sorted_scores, -threshold, side="right")
+    tp = sorted_labels[:num_predicted].sum()
+    fp = num_predicted - tp
+    fn = num_positive - tp
+    tn = num_negative - fp
+
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / num_positive if num_positive else 0.0
+
+    return {
+        "labels": labels,
+        "scores": scores,
+        "fpr": fpr,
+        "tpr": tpr,
+        "thresholds": thresholds,
+        "precision_curve": precision_curve,
+        "recall_curve": recall_curve,
+        "roc_auc": roc_auc,
+        "average_precision": average_precision,
+        "accuracy": float((tp + tn) / len(labels)) if len(labels) else 0.0,
+        "precision": float(precision),
+        "recall": float(recall),
+        "f1": float(2 * precision * recall / (precision + recall)) if precision + recall else 0.0,
+        "confusion_matrix": np.array([[tn, fp], [fn, tp]]),
+        "loss": float(-np.mean(labels * np.log(np.clip(scores, 1e-7, 1)) +
+                               (1 - labels) * np.log(np.clip(1 - scores, 1e-7, 1))))
+    }
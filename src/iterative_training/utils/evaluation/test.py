@@ -0,0 +1,77 @@
+import unittest
+
+import numpy as np
+from sklearn import metrics
+
+from .functions import predict_batches, evaluate_predictions, downsample_curve
+
+
+class TestEvaluation(unittest.TestCase):
+
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 2, size=500)
+    # Rounded scores => ties
+    scores = np.round(np.clip(labels * 0.3 + rng.random(500) * 0.7, 0, 1), 2)
+
+    def test_metrics_match_sklearn(self):
+        evaluation = evaluate_predictions(self.labels, self.scores)
+        predictions = (self.scores >= 0.5).astype(int)
+
+        expected = {
+            "roc_auc": metrics.roc_auc_score(self.labels, self.scores),
+            "average_precision": metrics.average_precision_score(self.labels, self.scores),
+            "accuracy": metrics.accuracy_score(self.labels, predictions),
+            "precision": metrics.precision_score(self.labels, predictions),
+            "recall": metrics.recall_score(self.labels, predictions),
+            "f1": metrics.f1_score(self.labels, predictions),
+            "loss": metrics.log_loss(self.labels, np.clip(self.scores, 1e-7, 1 - 1e-7))
+        }
+
+        for name, value in expected.items():
+            with self.subTest(metric=name):
+                self.assertAlmostEqual(evaluation[name], value, places=5)
+
+        with self.subTest():
+            np.testing.assert_array_equal(evaluation["confusion_matrix"],
+                                          metrics.confusion_matrix(self.labels, predictions))
+
+    def test_roc_curve_matches_sklearn(self):
+        evaluation = evaluate_predictions(self.labels, self.scores)
+        fpr, tpr, thresholds = metrics.roc_curve(self.labels, self.scores)
+
+        for name, expected in [("fpr", fpr), ("tpr", tpr), ("thresholds", thresholds)]:
+            with self.subTest(curve=name):
+                np.testing.assert_allclose(evaluation[name], expected)
+
+    def test_downsampled_roc(self):
+        rng = np.random.default_rng(1)
+        labels = rng.integers(0, 2, size=100000)
+        scores = labels * 0.2 + rng.random(100000) * 0.8
+
+        evaluation = evaluate_predictions(labels, scores)
+        fpr, tpr = downsample_curve(evaluation["fpr"], evaluation["tpr"], 500)
+
+        with self.subTest():
+            self.assertLessEqual(len(fpr), 500)
+
+        with self.subTest():
+            self.assertEqual((fpr[0], tpr[0], fpr[-1], tpr[-1]), (0, 0, 1, 1))
+
+        # Area under the downsampled curve stays close to the exact one
+        with self.subTest():
+            self.assertAlmostEqual(np.trapezoid(tpr, fpr), evaluation["roc_auc"], places=3)
+
+    def test_predict_batches(self):
+        class SumModel:
+            @staticmethod
+            def predict_on_batch(x):
+                return x.sum(axis=1, keepdims=True)
+
+        x_positive, x_negative = np.ones((7, 2)), np.zeros((10, 2))
+        labels, scores = predict_batches(SumModel(), x_positive, x_negative, batch_size=3, transform=lambda x: x / 2)
+
+        with self.subTest():
+            np.testing.assert_array_equal(labels, np.r_[np.zeros(10), np.ones(7)])
+
+        with self.subTest():
+            np.testing.assert_array_equal(scores, labels)
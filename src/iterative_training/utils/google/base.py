@@ -1,6 +1,130 @@
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from oauth2client.service_account import ServiceAccountCredentials
+import httplib2
 import json
+import random
+import threading
+import time
+
+
+# HTTP statuses retried by call_with_retry (quota and server errors)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_lock = threading.Lock()
+_services = {}
+_rate_limiters = {}
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket rate limiter - "rate" tokens are added per second up to "capacity",
+    each request takes one token (waits until a token is available).
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: float => requests per second in long run
+        :param capacity: int => number of requests which can be sent at once
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, waits if there is none.
+        :return: float => seconds waited
+        """
+        waited = 0.0
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+def get_rate_limiter(key, rate=1.0, capacity=10):
+    """
+    Returns TokenBucket shared by all clients using the same key (e.g. spreadsheet id). Rate and capacity are only
+    used when the limiter is created.
+    """
+    with _lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = TokenBucket(rate, capacity)
+        return _rate_limiters[key]
+
+
+def get_service(api, version, credentials, scopes):
+    """
+    Returns discovery service built for credentials file and scopes. Services (with their credentials and HTTP
+    connections) are cached and reused by all clients in the same thread (httplib2 connections are not thread safe).
+    """
+    key = (api, version, credentials, tuple(scopes), threading.get_ident())
+
+    with _lock:
+        service = _services.get(key)
+
+    if service is None:
+        creds = ServiceAccountCredentials.from_json_keyfile_name(credentials, scopes)
+        service = build(api, version, credentials=creds)
+
+        with _lock:
+            service = _services.setdefault(key, service)
+
+    return service
+
+
+def _is_retryable_(error):
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        # Drive reports exceeded rate limits by 403
+        return status in RETRY_STATUSES or (status == 403 and b"ateLimitExceeded" in (error.content or b""))
+
+    return isinstance(error, (ConnectionError, TimeoutError, httplib2.HttpLib2Error))
+
+
+def call_with_retry(call, rate_limiter=None, max_retries=5, base_delay=1.0, max_delay=64.0):
+    """
+    Calls call(). Quota (429, rate limit 403), server (5xx) and connection errors are retried with exponential
+    backoff with full jitter (Retry-After header is respected).
+
+    :param call: function sending a request
+    :param rate_limiter: TokenBucket => each attempt waits for a token
+    :param max_retries: int => number of retries before the error is raised
+    :param base_delay: float => maximal delay (seconds) of the first retry, doubled with each retry
+    :param max_delay: float => maximal delay of a retry
+    :return: result of call
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+
+        try:
+            return call()
+        except Exception as e:
+            if attempt == max_retries or not _is_retryable_(e):
+                raise
+
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+            retry_after = e.resp.get("retry-after") if isinstance(e, HttpError) else None
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+
+            time.sleep(delay)
 
 
 class GoogleBase:
@@ -8,6 +132,18 @@ class GoogleBase:
     credentials = None
     client_email = None
 
+    # Shared TokenBucket limiting requests of the client, retries of failed requests
+    rate_limiter = None
+    max_retries = 5
+    retry_delay = 1.0
+
+    def __retry__(self, call):
+        return call_with_retry(call, rate_limiter=self.rate_limiter, max_retries=self.max_retries,
+                               base_delay=self.retry_delay)
+
+    def __execute__(self, request):
+        return self.__retry__(request.execute)
+
     def __read_client_email__(self):
         with open(self.credentials, "r") as f:
             data = json.load(f)
@@ -16,12 +152,10 @@ class GoogleBase:
     def __get_sheets_service__(self):
         # use creds to create a client to interact with the Google Drive API
         scope = ['https://spreadsheets.google.com/feeds']
-        creds = ServiceAccountCredentials.from_json_keyfile_name(self.credentials, scope)
-        return build('sheets', 'v4', credentials=creds)
+        return get_service('sheets', 'v4', self.credentials, scope)
 
     def __get_drive_service__(self):
         # use creds to create a client to interact with the Google Drive API
         scope = ['https://www.googleapis.com/auth/drive.metadata.readonly',
                  'https://www.googleapis.com/auth/drive.file']
-        creds = ServiceAccountCredentials.from_json_keyfile_name(self.credentials, scope)
-        return build('drive', 'v3', credentials=creds)
+        return get_service('drive', 'v3', self.credentials, scope)
@@ -1,14 +1,29 @@
+import hashlib
+
 from googleapiclient.http import MediaFileUpload
 
-from .base import GoogleBase
+from .base import GoogleBase, get_rate_limiter
 
 
 class GoogleDrive(GoogleBase):
 
-    def __init__(self, credentials):
+    def __init__(self, credentials, rate_limit=10.0, max_retries=5, chunk_size=8 * 1024 * 1024):
+        """
+        :param credentials: path to service account credentials (json)
+        :param rate_limit: float => requests per second to Drive (shared by all clients of the process)
+        :param max_retries: int => retries of requests failed with quota, server or connection errors
+        :param chunk_size: int => bytes uploaded per request (multiple of 256 KB), a failed chunk is retried
+            without uploading the previous ones again
+        """
         self.credentials = credentials
         self.__read_client_email__()
         self.service = self.__get_drive_service__()
+        self.rate_limiter = get_rate_limiter("drive", rate=rate_limit)
+        self.max_retries = max_retries
+        self.chunk_size = chunk_size
+
+        # Folder id => folder metadata
+        self.folders = {}
 
     @staticmethod
     def __get_folder_id__(model_folder_url):
@@ -20,13 +35,64 @@ class GoogleDrive(GoogleBase):
 
     def get_file(self, file_id):
         try:
-            file = self.service.files().get(fileId=file_id, fields="id, name, mimeType, webViewLink").execute()
+            file = self.__execute__(self.service.files().get(fileId=file_id,
+                                                             fields="id, name, mimeType, webViewLink"))
             return file
         except Exception as e:
             print(f'An error | {e} | occurred while searching for folder "{file_id}". Does your client email "{self.client_email}" have access to it?')
             return None
 
-    def upload_file(self, file_name, file_path, g_drive_url):
+    def get_folder(self, folder_id):
+        """
+        Same as get_file, found folders are cached.
+        """
+        if folder_id not in self.folders:
+            folder = self.get_file(folder_id)
+            if folder is None:
+                return None
+            self.folders[folder_id] = folder
+
+        return self.folders[folder_id]
+
+    @staticmethod
+    def get_md5(file_path, block_size=8 * 1024 * 1024):
+        h = hashlib.md5()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def find_file(self, md5, folder_id):
+        """
+        Returns file in folder with given md5 checksum of content or None.
+        """
+        page_token = None
+
+        while True:
+            response = self.__execute__(self.service.files().list(
+                q=f"'{folder_id}' in parents and trashed = false",
+                fields="nextPageToken, files(id, name, md5Checksum, webViewLink)",
+                pageSize=1000,
+                pageToken=page_token))
+
+            for file in response.get("files", []):
+                if file.get("md5Checksum") == md5:
+                    return file
+
+            page_token = response.get("nextPageToken")
+            if page_token is None:
+                return None
+
+    def upload_file(self, file_name, file_path, g_drive_url, skip_existing=True, progress=True):
+        """
+        Uploads file in chunks of "chunk_size" bytes, an interrupted chunk is retried and the upload resumed.
+        :param file_name: name of the file in Drive
+        :param file_path: path of the uploaded file
+        :param g_drive_url: url of the parent folder
+        :param skip_existing: if True and the folder contains a file with the same content, it is returned instead
+        :param progress: if True, upload progress is printed
+        :return: dict with id and webViewLink of the file or None if the folder was not found
+        """
 
         parent_folder_id = self.__get_folder_id__(g_drive_url)
 
@@ -35,10 +101,24 @@ class GoogleDrive(GoogleBase):
             "parents": [parent_folder_id]
         }
 
-        if self.get_file(parent_folder_id):
+        if self.get_folder(parent_folder_id):
+            if skip_existing is True:
+                file = self.find_file(self.get_md5(file_path), parent_folder_id)
+                if file is not None:
+                    print(f"✅ {file_path} already uploaded as \"{file['name']}\"")
+                    return file
+
             # upload
-            media = MediaFileUpload(file_path, resumable=True)
-            file = self.service.files().create(body=file_metadata, media_body=media, fields='id, webViewLink').execute()
+            media = MediaFileUpload(file_path, chunksize=self.chunk_size, resumable=True)
+            request = self.service.files().create(body=file_metadata, media_body=media, fields='id, webViewLink')
+
+            file = None
+            while file is None:
+                # After a failure, next_chunk asks the server how much was received and continues from there
+                status, file = self.__retry__(request.next_chunk)
+
+                if status is not None and progress is True:
+                    print(f"⬆️ {file_name} \t {int(status.progress() * 100)} %")
 
             # Return link to created file
             return file
@@ -46,4 +126,4 @@ class GoogleDrive(GoogleBase):
         return None
 
     def delete_file(self, file_id):
-        self.service.files().delete(fileId=file_id).execute()
+        self.__execute__(self.service.files().delete(fileId=file_id))
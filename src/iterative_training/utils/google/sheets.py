@@ -1,3 +1,5 @@
+import contextlib
+import random
 import typing
 
 import numpy
@@ -5,21 +7,33 @@ import numpy as np
 import pandas as pd
 from googleapiclient.http import MediaFileUpload
 
-from .base import GoogleBase
+from .base import GoogleBase, get_rate_limiter
 
 
 class GoogleSheets(GoogleBase):
 
-    def __init__(self, credentials, sheet_url):
+    def __init__(self, credentials, sheet_url, rate_limit=1.0, max_retries=5):
+        """
+        :param credentials: path to service account credentials (json)
+        :param sheet_url: url of the spreadsheet
+        :param rate_limit: float => requests per second to the spreadsheet (shared by all clients of the process)
+        :param max_retries: int => retries of requests failed with quota, server or connection errors
+        """
         self.credentials = credentials
         self.service = self.__get_sheets_service__()
         self.spreadsheet_id = self.__get_spreadsheet_id__(sheet_url)
+        self.rate_limiter = get_rate_limiter(f"sheets/{self.spreadsheet_id}", rate=rate_limit)
+        self.max_retries = max_retries
 
         # Current worksheet (tab)
         self.worksheet_title = None
         self.worksheet_id = None
         self.endRowIndex = 1  # Helper variable to keep track of where to start writing values
 
+        # Requests queued in batch mode (see start_batch)
+        self.pending_requests = None
+        self.pending_values = None
+
     @staticmethod
     def __get_spreadsheet_id__(sheet_url):
         """
@@ -28,6 +42,70 @@ class GoogleSheets(GoogleBase):
         """
         return sheet_url.split("/")[-2]
 
+    def start_batch(self):
+        """
+        Starts batch mode - sheet requests (addSheet, addChart, ...) and value writes are not sent right away,
+        but queued and sent by flush in one spreadsheets().batchUpdate and one values().batchUpdate.
+        IDs of new sheets are assigned locally, so they can be used before the batch is sent.
+        """
+        self.pending_requests = []
+        self.pending_values = []
+
+    def flush(self):
+        """
+        Sends requests queued since start_batch and ends batch mode.
+        :return: (batchUpdate response, values batchUpdate response), None for requests not sent
+        """
+        requests, values = self.pending_requests, self.pending_values
+        self.pending_requests = self.pending_values = None
+
+        result, values_result = None, None
+
+        if requests:
+            result = self.__execute__(self.service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id,
+                                                                              body={"requests": requests}))
+
+        if values:
+            values_result = self.__execute__(self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body={"valueInputOption": "USER_ENTERED", "data": values}))
+
+        return result, values_result
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager for batch mode, queued requests are sent when the block finishes without an exception.
+
+            with gs.batch():
+                gs.create_sheet(...)
+                gs.insert_chart(...)
+        """
+        self.start_batch()
+        try:
+            yield self
+        except BaseException:
+            self.pending_requests = self.pending_values = None
+            raise
+
+        self.flush()
+
+    @property
+    def batching(self):
+        return self.pending_requests is not None
+
+    def __send_request__(self, request):
+        """
+        Sends a single spreadsheets().batchUpdate request (queues it in batch mode).
+        :return: response or None if queued
+        """
+        if self.batching:
+            self.pending_requests.append(request)
+            return None
+
+        return self.__execute__(self.service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id,
+                                                                        body={"requests": [request]}))
+
     def get_sheet(self, sheet_id=None, sheet_title=None):
 
         """
@@ -41,7 +119,7 @@ class GoogleSheets(GoogleBase):
         if sheet_id is None and sheet_title is None:
             return None
 
-        spreadsheet = self.service.spreadsheets().get(spreadsheetId=self.spreadsheet_id).execute()
+        spreadsheet = self.__execute__(self.service.spreadsheets().get(spreadsheetId=self.spreadsheet_id))
 
         for _sheet in spreadsheet['sheets']:
             if (sheet_id and _sheet['properties']['sheetId'] == sheet_id) or \
@@ -72,25 +150,26 @@ class GoogleSheets(GoogleBase):
               "blue": 0.0
             }
 
-        resp = self.service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body={"requests": [
-            {
-                "addSheet": sheet_props
-            }
-        ]
-        }).execute()
+        if self.batching:
+            # Sheet ID has to be known before the sheet is created
+            sheet_props['properties']['sheetId'] = random.randint(1, 2 ** 31 - 1)
+
+        resp = self.__send_request__({
+            "addSheet": sheet_props
+        })
 
         self.worksheet_title = title
-        self.worksheet_id = resp['replies'][0]['addSheet']['properties']['sheetId']
+        if resp is None:
+            self.worksheet_id = sheet_props['properties']['sheetId']
+        else:
+            self.worksheet_id = resp['replies'][0]['addSheet']['properties']['sheetId']
 
     def remove_sheet(self, sheet_id):
-        resp = self.service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body={"requests": [
-            {
-                "deleteSheet": {
-                    "sheetId": sheet_id
-                }
+        resp = self.__send_request__({
+            "deleteSheet": {
+                "sheetId": sheet_id
             }
-        ]
-        }).execute()
+        })
 
     def insert_data(self, data, row, column="B") -> dict:
         """
@@ -114,15 +193,21 @@ class GoogleSheets(GoogleBase):
 
         self.endRowIndex = row + len(data)
 
+        data_range = f"{self.worksheet_title}!{column}{row}:{chr(ord(column) + len(data[0]))}{row + len(data)}"
+
+        if self.batching:
+            self.pending_values.append({"range": data_range, "values": data})
+            return coords
+
         # TODO: replace with ...values.append(...) ?
-        self.service.spreadsheets().values().append(
+        self.__execute__(self.service.spreadsheets().values().append(
             spreadsheetId=self.spreadsheet_id,
-            range=f"{self.worksheet_title}!{column}{row}:{chr(ord(column) + len(data[0]))}{row + len(data)}",
+            range=data_range,
             # range=f"{self.worksheet_title}!A1:Z1",
             valueInputOption="USER_ENTERED",
             body={
                 "values": data
-            }).execute()
+            }))
 
         return coords
 
@@ -147,7 +232,7 @@ class GoogleSheets(GoogleBase):
         :param chart_type: one of: (BAR, LINE, AREA, COLUMN, SCATTER, COMBO, STEPPED_AREA)
         :param kwargs: data_offset, legend_x_title, legend_y_title, legend_position, ...
             data_offset can specify the offset used when inserting chart data
-        :return: result dict
+        :return: result dict (None in batch mode)
         """
 
         # TODO: add option to add data to a different sheet (better visual)
@@ -241,7 +326,5 @@ class GoogleSheets(GoogleBase):
             }
         }
 
-        result = self.service.spreadsheets().batchUpdate(
-            spreadsheetId=self.spreadsheet_id,
-            body={"requests": [body]}).execute()
+        result = self.__send_request__(body)
         return result
@@ -1,16 +1,32 @@
 import unittest
 import os
+import tempfile
+import http.server
+import json
+import threading
+import time
 
+import httplib2
 import pandas as pd
+import googleapiclient
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 
 from .drive import GoogleDrive
 from .sheets import GoogleSheets
+from .base import TokenBucket
 
 
 class GoogleDriveTester(unittest.TestCase):
 
     def test_file_upload_test(self):
-        with open("test.txt", "w") as writer:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        file = os.path.join(directory.name, "test.txt")
+
+        with open(file, "w") as writer:
             writer.write("""
             THIS IS A TEST FILE! PLEASE DELETE ME IF YOU SEE ME...
             
@@ -33,13 +49,10 @@ class GoogleDriveTester(unittest.TestCase):
 
         gd = GoogleDrive(credentials="../../data/credentials.json")
 
-        file = "./test.txt"
-
         drive_file = gd.upload_file("test_drive.txt", file,
                                     "https://drive.google.com/drive/u/0/folders/1HioXiaThtx4iectL27xeSkthOTMCfKa9")
 
-        if os.path.exists(file):
-            os.remove(file)
+        if drive_file is not None:
             gd.delete_file(drive_file['id'])
 
         self.assertIsInstance(drive_file, dict)
@@ -65,3 +78,242 @@ class GoogleSheetsTester(unittest.TestCase):
         print(result)
 
         self.assertIsInstance(result, dict)
+
+
+class FakeSheetsService:
+    """
+    Records calls of spreadsheets().batchUpdate / values().batchUpdate / values().append.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def __getattr__(self, name):
+        def request(**kwargs):
+            self.calls.append((name, kwargs))
+            return self
+
+        return request
+
+    def execute(self):
+        return {}
+
+
+class GoogleSheetsBatchTester(unittest.TestCase):
+
+    def test_batch(self):
+        gs = GoogleSheets.__new__(GoogleSheets)
+        gs.service, gs.spreadsheet_id = FakeSheetsService(), "sheet"
+        gs.endRowIndex, gs.pending_requests, gs.pending_values = 1, None, None
+
+        with gs.batch():
+            gs.create_sheet("Results", 50, 20)
+            gs.insert_data([["Title:", "test"]], 2)
+            gs.insert_chart(data=pd.DataFrame(data={"x": [1, 2], "y": [3, 4]}), title="Chart")
+
+            with self.subTest():
+                self.assertEqual(gs.service.calls, [])
+
+        (name, kwargs), (values_name, values_kwargs) = gs.service.calls
+        requests = kwargs["body"]["requests"]
+        sheet_id = requests[0]["addSheet"]["properties"]["sheetId"]
+
+        with self.subTest():
+            self.assertEqual((name, values_name, len(requests)), ("batchUpdate", "batchUpdate", 2))
+
+        with self.subTest():
+            self.assertEqual(requests[1]["addChart"]["chart"]["position"]["overlayPosition"]["anchorCell"]["sheetId"],
+                             sheet_id)
+
+        with self.subTest():
+            self.assertEqual(len(values_kwargs["body"]["data"]), 2)
+
+
+class FakeGoogleHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers requests with queued (status, body) responses of the server.
+    """
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.paths.append(self.path)
+
+        status, body = self.server.responses.pop(0)
+        content = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class GoogleRetryTester(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeGoogleHandler)
+        self.server.paths, self.server.responses = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.gs = GoogleSheets.__new__(GoogleSheets)
+        self.gs.service = build("sheets", "v4", http=httplib2.Http(), static_discovery=True,
+                                client_options={"api_endpoint": f"http://127.0.0.1:{self.server.server_port}/"})
+        self.gs.spreadsheet_id, self.gs.pending_requests, self.gs.pending_values = "sheet", None, None
+        self.gs.rate_limiter, self.gs.retry_delay = TokenBucket(100, 10), 0.01
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_quota_and_server_errors(self):
+        error = {"error": {"code": 429, "message": "Quota exceeded"}}
+        self.server.responses = [(429, error), (503, error), (200, {"replies": [{"addSheet": {
+            "properties": {"sheetId": 7}}}]})]
+
+        self.gs.create_sheet("Results", 50, 20)
+
+        with self.subTest():
+            self.assertEqual(self.gs.worksheet_id, 7)
+
+        with self.subTest():
+            self.assertEqual(len(self.server.paths), 3)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.responses = [(400, {"error": {"code": 400, "message": "Bad request"}})]
+
+        with self.subTest():
+            self.assertRaises(HttpError, self.gs.create_sheet, "Results", 50, 20)
+
+        with self.subTest():
+            self.assertEqual(len(self.server.paths), 1)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=50, capacity=2)
+        start = time.monotonic()
+
+        for _ in range(7):
+            bucket.acquire()
+
+        # 2 requests at once, the others wait for tokens
+        self.assertGreaterEqual(time.monotonic() - start, 5 / 50 * 0.9)
+
+
+class FakeDriveHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Minimal Drive API - folder metadata, listing and resumable upload (fails the PUT requests listed in "fail").
+    """
+
+    def _respond_(self, status, body=None, headers=()):
+        content = json.dumps(body or {}).encode()
+
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path))
+
+        if self.path.startswith("/drive/v3/files?"):
+            self._respond_(200, {"files": self.server.files})
+        else:
+            self._respond_(200, {"id": "folder", "name": "models"})
+
+    def do_POST(self):
+        self.server.requests.append(("POST", self.path))
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        # New upload session
+        self.server.received = b""
+        location = f"http://127.0.0.1:{self.server.server_port}/upload/session"
+        self._respond_(200, headers=[("Location", location)])
+
+    def do_PUT(self):
+        self.server.requests.append(("PUT", self.path))
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if len(self.server.requests) in self.server.fail:
+            self._respond_(503, {"error": {"code": 503, "message": "Backend error"}})
+            return
+
+        # Status query ("bytes */size") sends no data
+        self.server.received += data
+        total = int(self.headers["Content-Range"].split("/")[-1])
+
+        if len(self.server.received) == total:
+            self._respond_(200, {"id": "file", "webViewLink": "link"})
+        else:
+            self._respond_(308, headers=[("Range", f"bytes=0-{len(self.server.received) - 1}")])
+
+    def log_message(self, *args):
+        pass
+
+
+class GoogleDriveUploadTester(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeDriveHandler)
+        self.server.requests, self.server.files, self.server.fail, self.server.received = [], [], set(), b""
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        # Upload urls are built from rootUrl of the discovery document
+        with open(os.path.join(os.path.dirname(googleapiclient.__file__), "discovery_cache", "documents",
+                               "drive.v3.json")) as f:
+            document = json.load(f)
+        document["rootUrl"] = f"http://127.0.0.1:{self.server.server_port}/"
+
+        self.gd = GoogleDrive.__new__(GoogleDrive)
+        self.gd.service = build_from_document(document, http=build_http())
+        self.gd.rate_limiter, self.gd.retry_delay, self.gd.max_retries = TokenBucket(100, 10), 0.01, 5
+        self.gd.chunk_size, self.gd.folders = 256 * 1024, {}
+
+        self.file = tempfile.NamedTemporaryFile(suffix=".h5", delete=False)
+        self.content = os.urandom(600 * 1024)
+        self.file.write(self.content)
+        self.file.close()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.file.name)
+
+    def test_resumed_chunked_upload(self):
+        # GET folder, GET list, POST session, PUT chunk 1, PUT chunk 2 fails
+        self.server.fail = {5}
+        url = "https://drive.google.com/drive/u/0/folders/folder"
+
+        file = self.gd.upload_file("model.h5", self.file.name, url, progress=False)
+        self.gd.upload_file("model.h5", self.file.name, url, progress=False, skip_existing=False)
+
+        with self.subTest():
+            self.assertEqual(file["id"], "file")
+
+        with self.subTest():
+            self.assertEqual(self.server.received, self.content)
+
+        # Folder is looked up only once
+        with self.subTest():
+            self.assertEqual(sum(path.startswith("/drive/v3/files/folder") for _, path in self.server.requests), 1)
+
+    def test_skip_existing(self):
+        self.server.files = [{"id": "old", "name": "model_old.h5", "md5Checksum": GoogleDrive.get_md5(self.file.name)}]
+
+        file = self.gd.upload_file("model.h5", self.file.name, "https://drive.google.com/drive/folders/folder")
+
+        with self.subTest():
+            self.assertEqual(file["id"], "old")
+
+        with self.subTest():
+            self.assertNotIn("POST", [method for method, _ in self.server.requests])
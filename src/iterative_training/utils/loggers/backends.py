@@ -0,0 +1,257 @@
+import os
+import pickle
+import re
+import shutil
+from datetime import datetime
+
+import pandas as pd
+from matplotlib.figure import Figure
+
+
+class GoogleBackend:
+    """
+    Writes logs (payloads created by GoogleDriveLogger.prepare) to Google Sheets, models are uploaded to Google Drive.
+    """
+
+    def __init__(self, google_drive=None, google_sheets=None):
+        self.gd = google_drive
+        self.gs = google_sheets
+
+        self.data_sheet = {
+            "title": "",
+            "id": ""
+        }
+
+        self.display_sheet = {
+            "title": "",
+            "id": ""
+        }
+
+    def send(self, payload):
+        """
+        Uploads model to Google Drive and writes payload to Google Sheets. Finished steps are recorded in
+        payload["sent"], so that a payload which failed can be sent again (model is not uploaded twice, sheets left
+        by the failed attempt are replaced).
+        """
+
+        title = payload["title"]
+        data = list(payload["data"])
+        chart_anchor_column = payload["chart_anchor_column"]
+        sent = payload.setdefault("sent", {})
+
+        # Save model to drive (before sheets, so that a failed upload leaves no sheets)
+        if payload["model_file_name"] is not None and "model_link" not in sent:
+            sent["model_link"] = self.gd.upload_file(payload["model_file_name"],
+                                                     payload["saved_model_path"],
+                                                     payload["gd_folder_url"])["webViewLink"]
+
+        # Sheets of a failed attempt (created if the value writes failed)
+        old_sheet_ids = [sheet_id for sheet_id in sent.get("sheet_ids", [])
+                         if self.gs.get_sheet(sheet_id=sheet_id) is not None]
+
+        # All sheet requests are sent at once when the block ends (nothing is sent if it fails)
+        with self.gs.batch():
+            for sheet_id in old_sheet_ids:
+                self.gs.remove_sheet(sheet_id)
+
+            # Add new sheet for current experiment
+            # TODO: Check if given sheet already exists => causes "APIError"
+
+            # Create the main sheet for displaying results
+
+            self.gs.create_sheet(title, 100, 20)
+            self.display_sheet['title'] = title
+            self.display_sheet['id'] = self.gs.worksheet_id
+
+            # Create "helper" sheet for storing data
+            self.gs.create_sheet(f"{title} => data", 100, 20)
+            self.data_sheet['title'] = f"{title} => data"
+            self.data_sheet['id'] = self.gs.worksheet_id
+
+            sent["sheet_ids"] = [self.display_sheet['id'], self.data_sheet['id']]
+
+            # Switch to data sheet
+            self.gs.worksheet_id = self.display_sheet['id']
+            self.gs.worksheet_title = self.display_sheet['title']
+            self.gs.endRowIndex = 1
+
+            # Include model link
+            if "model_link" in sent:
+                data.append(["Model link: ", sent["model_link"]])
+                data.append([""])
+
+            # Experiment model description
+            data.append(["Model Summary:", payload["model_summary"]])
+            data.append([""])
+
+            self.gs.insert_data(data, 2, "B")
+
+            # Switch to data sheet
+            self.gs.worksheet_id = self.data_sheet['id']
+            self.gs.worksheet_title = self.data_sheet['title']
+            self.gs.endRowIndex = 1
+
+            if payload["roc"] is not None:
+
+                # Insert ROC AUC
+                self.gs.insert_chart(data=payload["roc"],
+                                     title=f"AUC - {payload['auc']}",
+                                     chart_type="LINE",
+                                     legend_x_title="False Positive Rate",
+                                     legend_y_title="True Positive Rate",
+                                     worksheet_id=self.display_sheet['id'],
+                                     row_index=5,
+                                     column=chart_anchor_column
+                                     )
+
+            if payload["history"] is not None:
+                # Insert history
+                self.gs.insert_chart(data=payload["history"],
+                                     title="History",
+                                     chart_type="LINE",
+                                     legend_x_title="Epoch",
+                                     legend_y_title="Value",
+                                     worksheet_id=self.display_sheet['id'],
+                                     row_index=2,
+                                     column=chart_anchor_column
+                                     )
+
+
+class LocalBackend:
+    """
+    Writes each log to its own directory (no network needed):
+        - summary, roc and history tables (.csv or .parquet)
+        - roc.png, history.png charts
+        - model file (hard link, or copy if it cannot be linked)
+        - payload.pkl, so that the log can be sent to another backend later (see sync)
+    """
+
+    def __init__(self, directory, table_format="csv"):
+        """
+        :param directory: str => directory with logged runs
+        :param table_format: "csv" or "parquet" (requires pyarrow - "parquet" extra)
+        """
+        self.directory = directory
+        self.table_format = table_format
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _write_table_(self, df, path):
+        if self.table_format == "parquet":
+            df.to_parquet(f"{path}.parquet", index=False)
+        else:
+            df.to_csv(f"{path}.csv", index=False)
+
+    @staticmethod
+    def _plot_(df, title, x_title, y_title, path):
+        """
+        Plots each column of df against the first one.
+        """
+        figure = Figure(figsize=(8, 5))
+        ax = figure.subplots()
+
+        for column in df.columns[1:]:
+            ax.plot(df[df.columns[0]], df[column], label=column)
+
+        ax.set_title(title)
+        ax.set_xlabel(x_title)
+        ax.set_ylabel(y_title)
+        ax.legend()
+
+        figure.savefig(path)
+
+    @staticmethod
+    def _link_(source, target):
+        try:
+            os.link(source, target)
+        except OSError:
+            # Different file system or links are not supported
+            shutil.copy2(source, target)
+
+    def send(self, payload):
+        """
+        Writes payload to a new run directory.
+        :return: str => path of the run directory
+        """
+        name = re.sub(r"[^\w.-]+", "_", payload["title"]).strip("_") or "run"
+        path = os.path.join(self.directory, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{name}")
+        os.makedirs(path)
+
+        payload = dict(payload)
+
+        # Rows of the display sheet (model summary is stored as text)
+        rows = [[str(value) for value in row] for row in payload["data"]]
+        self._write_table_(pd.DataFrame(data=rows).fillna(""), os.path.join(path, "summary"))
+
+        with open(os.path.join(path, "model_summary.txt"), "w") as f:
+            f.write(payload["model_summary"])
+
+        if payload["roc"] is not None:
+            self._write_table_(payload["roc"], os.path.join(path, "roc"))
+            self._plot_(payload["roc"], f"AUC - {payload['auc']}", "False Positive Rate", "True Positive Rate",
+                        os.path.join(path, "roc.png"))
+
+        if payload["history"] is not None:
+            self._write_table_(payload["history"], os.path.join(path, "history"))
+            self._plot_(payload["history"], "History", "Epoch", "Value", os.path.join(path, "history.png"))
+
+        if payload["model_file_name"] is not None and payload["saved_model_path"] is not None:
+            model_file = f"model{os.path.splitext(payload['saved_model_path'])[1]}"
+            self._link_(payload["saved_model_path"], os.path.join(path, model_file))
+
+            # Model path relative to the run directory
+            payload["saved_model_path"] = model_file
+
+        write_payload(payload, os.path.join(path, "payload.pkl"))
+
+        return path
+
+
+def write_payload(payload, path):
+    """
+    Pickles payload to path (written to a temporary file first, so that path always holds a whole payload).
+    """
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump(payload, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def sync(directory, backend):
+    """
+    Sends runs logged by LocalBackend to another backend (e.g. GoogleBackend), runs already sent are skipped
+    (marked by a ".synced" file in the run directory).
+    :param directory: str => directory of LocalBackend
+    :param backend: backend with send(payload)
+    :return: (list of synced run directories, list of run directories which failed)
+    """
+    synced, failed = [], []
+
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+
+        if not os.path.isfile(os.path.join(path, "payload.pkl")) or os.path.exists(os.path.join(path, ".synced")):
+            continue
+
+        with open(os.path.join(path, "payload.pkl"), "rb") as f:
+            payload = pickle.load(f)
+
+        model_path = payload["saved_model_path"]
+        if model_path is not None:
+            payload["saved_model_path"] = os.path.join(path, model_path)
+
+        try:
+            backend.send(payload)
+        except Exception as e:
+            print(f"⚠️ {name} could not be synced ({e})")
+            failed.append(path)
+
+            # Keep steps finished by the backend (see GoogleBackend.send) for the next sync
+            payload["saved_model_path"] = model_path
+            write_payload(payload, os.path.join(path, "payload.pkl"))
+            continue
+
+        open(os.path.join(path, ".synced"), "w").close()
+        synced.append(path)
+        print(f"✅ {name} synced")
+
+    return synced, failed
@@ -1,26 +1,54 @@
 from datetime import datetime
 import contextlib
 import io
+import os
+import pickle
+import queue
+import tempfile
+import threading
+import time
+import uuid
 import pandas as pd
 import numpy as np
-from sklearn import metrics
+
+from ..evaluation.functions import predict_batches, evaluate_predictions, downsample_curve
+from .backends import GoogleBackend, write_payload
 
 
 class GoogleDriveLogger:
 
-    def __init__(self, google_drive=None, google_sheets=None):
+    def __init__(self, google_drive=None, google_sheets=None,
+                 asynchronous=False, max_queue_size=8, outbox_dir=None, retry_interval=60, backend=None):
+        """
+        :param google_drive: GoogleDrive
+        :param google_sheets: GoogleSheets
+        :param backend: where logs are written (see loggers.backends), GoogleBackend with google_drive and
+            google_sheets by default
+        :param asynchronous: if True, log only prepares the logged data and returns, data are sent to Google
+            by a background thread (call flush or close to wait for it)
+        :param max_queue_size: int => number of logs waiting in memory, further logs are spilled to the outbox
+        :param outbox_dir: directory where logs which could not be sent (or queued) are stored and retried from
+            (temporary directory by default)
+        :param retry_interval: seconds between retries of logs in the outbox
+        """
         self.gd = google_drive
         self.gs = google_sheets
+        self.backend = backend if backend is not None else GoogleBackend(google_drive, google_sheets)
 
-        self.data_sheet = {
-            "title": "",
-            "id": ""
-        }
+        self.asynchronous = asynchronous
+        self.retry_interval = retry_interval
+        self.outbox_dir = outbox_dir
+        self.queue = None
+        self.worker = None
 
-        self.display_sheet = {
-            "title": "",
-            "id": ""
-        }
+        if asynchronous is True:
+            if self.outbox_dir is None:
+                self.outbox_dir = tempfile.mkdtemp(prefix="logger_outbox_")
+            os.makedirs(self.outbox_dir, exist_ok=True)
+
+            self.queue = queue.Queue(maxsize=max_queue_size)
+            self.worker = threading.Thread(target=self._work_, daemon=True)
+            self.worker.start()
 
     def log(self,
             title="",
@@ -34,7 +62,9 @@ class GoogleDriveLogger:
             saved_model_path=None,
             experiment_link=None,
             chart_anchor_column="J",
-            iterative_training_conf=None):
+            iterative_training_conf=None,
+            evaluation=None,
+            max_roc_points=500):
 
         """
 
@@ -46,36 +76,64 @@ class GoogleDriveLogger:
         :param evaluation_functions: array of callables taking arguments y_pred, y_true. Each will be added.
         :param history:
         :param gd_folder_url:
-        :param saved_model_path:
+        :param saved_model_path: (in asynchronous mode, the file has to exist until the log is sent)
         :param experiment_link:
         :param chart_anchor_column:
         :param iterative_training_conf:
+        :param evaluation: output of evaluate_predictions (e.g. IterativeModel.evaluation set by fit_iterative),
+            if not given, test datasets of the sampler are predicted
+        :param max_roc_points: int => the ROC curve is downsampled to at most this many points for the chart
         :return:
         """
 
-        # Add new sheet for current experiment
-        # TODO: Check if given sheet already exists => causes "APIError"
-
-        # Create the main sheet for displaying results
-
-        self.gs.create_sheet(title, 100, 20)
-        self.display_sheet['title'] = title
-        self.display_sheet['id'] = self.gs.worksheet_id
-
-        # Create "helper" sheet for storing data
-        self.gs.create_sheet(f"{title} => data", 100, 20)
-        self.data_sheet['title'] = f"{title} => data"
-        self.data_sheet['id'] = self.gs.worksheet_id
-
-        # Switch to data sheet
-        self.gs.worksheet_id = self.display_sheet['id']
-        self.gs.worksheet_title = self.display_sheet['title']
-        self.gs.endRowIndex = 1
+        payload = self.prepare(title=title,
+                               description=description,
+                               model=model,
+                               save_model=save_model,
+                               sampler=sampler,
+                               evaluation_functions=evaluation_functions,
+                               history=history,
+                               gd_folder_url=gd_folder_url,
+                               saved_model_path=saved_model_path,
+                               experiment_link=experiment_link,
+                               chart_anchor_column=chart_anchor_column,
+                               evaluation=evaluation,
+                               max_roc_points=max_roc_points)
+
+        if self.asynchronous is False:
+            self.send(payload)
+            return
+
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            self._spill_(payload)
+
+    def prepare(self,
+                title="",
+                description="",
+                model=None,
+                save_model=True,
+                sampler=None,
+                evaluation_functions=[],
+                history=None,
+                gd_folder_url=None,
+                saved_model_path=None,
+                experiment_link=None,
+                chart_anchor_column="J",
+                evaluation=None,
+                max_roc_points=500):
+        """
+        Evaluates model and prepares everything that is logged (see log) into a payload for send. Payload only
+        contains plain data (no model or sampler), so it can be sent later or stored.
+        :return: dict
+        """
 
+        date = datetime.now()
         data = list()
 
         # Add date and title
-        data.append(["Date:", datetime.now().strftime('%Y/%m/%d, %H:%M:%S')])
+        data.append(["Date:", date.strftime('%Y/%m/%d, %H:%M:%S')])
         data.append(["Title:", title])
         data.append([""])
 
@@ -88,14 +146,19 @@ class GoogleDriveLogger:
             data.append(["Ntb. link: ", experiment_link])
             data.append([""])
 
-        if sampler is not None:
+        if evaluation is None and sampler is not None:
+            evaluation = evaluate_predictions(*predict_batches(model, sampler.test_p, sampler.test_n,
+                                                               transform=sampler.expand))
+
+        df_roc, auc = None, None
+
+        if evaluation is not None:
 
-            predictions_proba = model.predict(np.concatenate((sampler.test_n, sampler.test_p)))
-            labels = np.concatenate((np.zeros(len(sampler.test_n)), np.ones(len(sampler.test_p))))
+            labels = evaluation["labels"]
 
             # Evaluate - precision, recall
-            predictions = np.zeros(len(predictions_proba))
-            predictions[np.reshape(predictions_proba, (len(predictions_proba))) >= 0.5] = 1
+            predictions = np.zeros(len(labels))
+            predictions[evaluation["scores"] >= 0.5] = 1
 
             if len(evaluation_functions):
                 data.append(["Evaluation"])
@@ -105,13 +168,13 @@ class GoogleDriveLogger:
 
             data.append([""])
 
-        # Save model to drive and include link
-        if save_model is True:
-            url = self.gd.upload_file(f"model_{title}_{datetime.now().strftime('%Y%m%d_%H:%M:%S')}",
-                                      saved_model_path,
-                                      gd_folder_url)["webViewLink"]
-            data.append(["Model link: ", url])
-            data.append([""])
+            # ROC AUC
+            auc = evaluation["roc_auc"]
+            fpr, tpr = downsample_curve(evaluation["fpr"], evaluation["tpr"], max_roc_points)
+            df_roc = pd.DataFrame(data={
+                'False Positive Rate': fpr,
+                'True Positive Rate': tpr
+            })
 
         # Get model summary
         f = io.StringIO()
@@ -119,51 +182,133 @@ class GoogleDriveLogger:
             model.summary()
         model_summary = f.getvalue()
 
-        # Experiment model description
-        data.append(["Model Summary:", model_summary])
-        data.append([""])
+        df_history = None
+        if history is not None:
+            df_history = pd.DataFrame(data=history)
+            df_history.reset_index(inplace=True)
+            df_history.rename(columns={"index": "epochs"}, inplace=True)
 
-        self.gs.insert_data(data, 2, "B")
+        return {
+            "title": title,
+            "data": data,
+            "model_file_name": f"model_{title}_{date.strftime('%Y%m%d_%H:%M:%S')}" if save_model is True else None,
+            "saved_model_path": saved_model_path,
+            "gd_folder_url": gd_folder_url,
+            "model_summary": model_summary,
+            "roc": df_roc,
+            "auc": auc,
+            "history": df_history,
+            "chart_anchor_column": chart_anchor_column,
+            # Steps already done by the backend (payloads which failed are sent again)
+            "sent": {}
+        }
 
-        # Switch to data sheet
-        self.gs.worksheet_id = self.data_sheet['id']
-        self.gs.worksheet_title = self.data_sheet['title']
-        self.gs.endRowIndex = 1
+    def send(self, payload):
+        """
+        Writes payload created by prepare with the backend.
+        """
+        self.backend.send(payload)
 
-        if sampler is not None:
+    # ---------- Asynchronous mode ----------- #
 
-            # Insert ROC AUC
-            fpr, tpr, _ = metrics.roc_curve(
-                labels, predictions_proba
-            )
+    def _spill_(self, payload):
+        """
+        Stores payload to the outbox (file names keep the order of logs).
+        """
+        write_payload(payload, os.path.join(self.outbox_dir, f"{time.time_ns()}_{uuid.uuid4().hex[:8]}.pkl"))
 
-            auc = metrics.roc_auc_score(np.concatenate((np.zeros(len(sampler.test_n)), np.ones(len(sampler.test_p)))),
-                                        predictions_proba)
-            df_roc = pd.DataFrame(data={
-                'False Positive Rate': fpr,
-                'True Positive Rate': tpr
-            })
-            self.gs.insert_chart(data=pd.DataFrame(data=df_roc),
-                                 title=f"AUC - {auc}",
-                                 chart_type="LINE",
-                                 legend_x_title="False Positive Rate",
-                                 legend_y_title="True Positive Rate",
-                                 worksheet_id=self.display_sheet['id'],
-                                 row_index=5,
-                                 column=chart_anchor_column
-                                 )
+    def _retry_outbox_(self):
+        """
+        Sends payloads from the outbox in order, stops at the first failure.
+        :return: True if the outbox is empty
+        """
+        for file_name in sorted(os.listdir(self.outbox_dir)):
+            if not file_name.endswith(".pkl"):
+                continue
 
-        if history is not None:
-            # Insert history
-            df_history = pd.DataFrame(data=history)
-            df_history.reset_index(inplace=True)
-            df_history.rename(columns={"index": "epochs"}, inplace=True)
-            self.gs.insert_chart(data=df_history,
-                                 title="History",
-                                 chart_type="LINE",
-                                 legend_x_title="Epoch",
-                                 legend_y_title="Value",
-                                 worksheet_id=self.display_sheet['id'],
-                                 row_index=2,
-                                 column=chart_anchor_column
-                                 )
+            path = os.path.join(self.outbox_dir, file_name)
+            with open(path, "rb") as f:
+                payload = pickle.load(f)
+
+            try:
+                self.send(payload)
+            except Exception as e:
+                print(f"⚠️ logging of \"{payload['title']}\" failed again ({e}), it stays in outbox {self.outbox_dir}")
+                # Keep steps done by the backend
+                write_payload(payload, path)
+                return False
+
+            os.remove(path)
+
+        return True
+
+    def _work_(self):
+        """
+        Background thread sending queued payloads. Payloads which fail are stored to the outbox, which is retried
+        every "retry_interval" seconds and on flush.
+        """
+        last_retry = time.monotonic()
+
+        while True:
+            try:
+                item = self.queue.get(timeout=self.retry_interval)
+            except queue.Empty:
+                item = None
+
+            try:
+                if isinstance(item, tuple):
+                    # ("flush" | "close", event)
+                    command, event = item
+                    self._retry_outbox_()
+                    event.set()
+
+                    if command == "close":
+                        return
+
+                elif item is not None:
+                    try:
+                        self.send(item)
+                    except Exception as e:
+                        print(f"⚠️ logging of \"{item['title']}\" failed ({e}), it will be retried from outbox")
+                        self._spill_(item)
+
+                if item is None or time.monotonic() - last_retry >= self.retry_interval:
+                    self._retry_outbox_()
+                    last_retry = time.monotonic()
+            finally:
+                if item is not None:
+                    self.queue.task_done()
+
+    def _wait_(self, command, timeout):
+        done = threading.Event()
+        self.queue.put((command, done))
+
+        if not done.wait(timeout):
+            return False
+
+        return not any(file_name.endswith(".pkl") for file_name in os.listdir(self.outbox_dir))
+
+    def flush(self, timeout=None):
+        """
+        Waits until all queued logs are processed and retries logs from the outbox.
+        :param timeout: seconds to wait (None => wait until done)
+        :return: True if nothing is left in the queue or outbox
+        """
+        if self.worker is None:
+            return True
+
+        return self._wait_("flush", timeout)
+
+    def close(self, timeout=None):
+        """
+        Flushes logs and stops the background thread (logs left in the outbox are kept on disk).
+        :return: True if nothing is left in the queue or outbox
+        """
+        if self.worker is None:
+            return True
+
+        worker, self.worker = self.worker, None
+        result = self._wait_("close", timeout)
+        worker.join(timeout)
+
+        return result
@@ -0,0 +1,29 @@
+"""
+Sends runs logged by LocalBackend to Google Sheets / Google Drive:
+
+    python -m iterative_training.utils.loggers.sync RUNS_DIR --credentials credentials.json --sheet-url URL
+"""
+import argparse
+
+from ..google.drive import GoogleDrive
+from ..google.sheets import GoogleSheets
+from .backends import GoogleBackend, sync
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Sync locally logged runs to Google Sheets and Google Drive.")
+    parser.add_argument("directory", help="directory of LocalBackend")
+    parser.add_argument("--credentials", required=True, help="service account credentials (json)")
+    parser.add_argument("--sheet-url", required=True, help="url of the spreadsheet")
+    args = parser.parse_args(args)
+
+    backend = GoogleBackend(GoogleDrive(args.credentials), GoogleSheets(args.credentials, args.sheet_url))
+
+    synced, failed = sync(args.directory, backend)
+
+    print(f"{len(synced)} runs synced, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,37 +1,315 @@
+import os
+import pickle
+import tempfile
+import threading
 import unittest
 
-from .base import GSLogger
+import numpy as np
+
+from .base import GoogleDriveLogger
+from .backends import GoogleBackend, LocalBackend, sync
+from ..evaluation.functions import evaluate_predictions
+from ..google.drive import GoogleDrive
+from ..google.sheets import GoogleSheets
 
 
 class LoggerTester(unittest.TestCase):
 
-    logger = GSLogger(
-        credentials="../loggers/credentials.json",
-        sheet_url="https://docs.google.com/spreadsheets/d/1f8zGb_ebp301HsfJhS2QB0HnYm_azFUCmzCua7Z1DQU/edit",
-        model_folder_url="https://drive.google.com/drive/u/0/folders/1HioXiaThtx4iectL27xeSkthOTMCfKa9"
-    )
+    def setUp(self):
+        self.logger = GoogleDriveLogger(google_drive=GoogleDrive(credentials="../../data/credentials.json"))
 
     def test_upload_to_google_drive(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        file = os.path.join(directory.name, "test.txt")
 
-        with open("test.txt", "w") as writer:
+        with open(file, "w") as writer:
             writer.write("""
-            Commodi deserunt ullam culpa laudantium culpa velit. Tempora et praesentium numquam tenetur minima. 
-            Maxime a voluptate adipisci. Pariatur quam officiis consequatur. Totam illo nemo dolore vero est sed. 
-            Doloribus asperiores asperiores enim eveniet fuga. Qui et dignissimos est in dolores. Maiores maiores ad 
+            Commodi deserunt ullam culpa laudantium culpa velit. Tempora et praesentium numquam tenetur minima.
+            Maxime a voluptate adipisci. Pariatur quam officiis consequatur. Totam illo nemo dolore vero est sed.
+            Doloribus asperiores asperiores enim eveniet fuga. Qui et dignissimos est in dolores. Maiores maiores ad
             maxime reiciendis exercitationem laboriosam et ex. Eos dolores voluptas aperiam exercitationem non impedit.
 
-            Veritatis aut explicabo dolores rem asperiores qui. Qui illo qui accusantium eaque officiis qui. 
+            Veritatis aut explicabo dolores rem asperiores qui. Qui illo qui accusantium eaque officiis qui.
             Magnam error hic ullam dolor eius.
 
-            Est adipisci et minima excepturi et commodi nulla. Dignissimos assumenda sed velit accusantium est. 
-            Perspiciatis quia dolorem corrupti voluptas aspernatur sit. Ullam qui sed debitis consequatur fuga 
+            Est adipisci et minima excepturi et commodi nulla. Dignissimos assumenda sed velit accusantium est.
+            Perspiciatis quia dolorem corrupti voluptas aspernatur sit. Ullam qui sed debitis consequatur fuga
             cupiditate quasi magni. Maiores non sit omnis asperiores amet ducimus dolor.
 
-            Maxime dolores tempora ullam debitis. Voluptatem maiores amet qui nihil odio. Molestias architecto hic 
-            tempore. Adipisci excepturi nihil recusandae quas quia nam ab sint. 
+            Maxime dolores tempora ullam debitis. Voluptatem maiores amet qui nihil odio. Molestias architecto hic
+            tempore. Adipisci excepturi nihil recusandae quas quia nam ab sint.
             Rerum voluptatem pariatur est ipsa nulla.
             """)
 
-        self.logger.upload_file_to_drive("test_test.txt", "test.txt")
+        drive_file = self.logger.gd.upload_file("test_test.txt", file,
+                                                "https://drive.google.com/drive/u/0/folders/1HioXiaThtx4iectL27xeSkthOTMCfKa9")
+
+        if drive_file is not None:
+            self.logger.gd.delete_file(drive_file['id'])
+
+        self.assertIsInstance(drive_file, dict)
+
+
+class FakeModel:
+
+    def summary(self):
+        print("Model: fake")
+
+
+class FlakyBackend:
+    """
+    Fails the first "failures" sends (or all of them if failures is None), sends wait for "release" to be set.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.sent = []
+        self.payloads = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def send(self, payload):
+        self.started.set()
+        self.release.wait()
+
+        sent = payload.setdefault("sent", {})
+        sent["attempts"] = sent.get("attempts", 0) + 1
+
+        if self.failures is None or self.failures > 0:
+            self.failures = self.failures - 1 if self.failures is not None else None
+            raise ConnectionError("Backend is not available")
+
+        self.sent.append(payload["title"])
+        self.payloads.append(payload)
+
+
+class AsyncLoggerTester(unittest.TestCase):
+
+    def setUp(self):
+        self.outbox_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.outbox_dir.cleanup)
+
+    def make_logger(self, backend, max_queue_size=8):
+        logger = GoogleDriveLogger(asynchronous=True, backend=backend, max_queue_size=max_queue_size,
+                                   outbox_dir=self.outbox_dir.name, retry_interval=3600)
+        self.addCleanup(logger.close, 5)
+        return logger
+
+    def outbox(self):
+        return sorted(os.listdir(self.outbox_dir.name))
+
+    def test_failed_logs_are_retried_on_flush(self):
+        backend = FlakyBackend(failures=2)
+        logger = self.make_logger(backend)
+
+        for title in ["first", "second", "third"]:
+            logger.log(title=title, model=FakeModel(), save_model=False)
+
+        with self.subTest():
+            self.assertTrue(logger.flush(5))
+
+        with self.subTest():
+            self.assertEqual(sorted(backend.sent), ["first", "second", "third"])
+
+        with self.subTest():
+            self.assertEqual(self.outbox(), [])
+
+    def test_full_queue_is_spilled(self):
+        backend = FlakyBackend()
+        backend.release.clear()
+        logger = self.make_logger(backend, max_queue_size=1)
+
+        # First log is being sent, second waits in the queue, third is spilled to the outbox
+        logger.log(title="first", model=FakeModel(), save_model=False)
+        backend.started.wait(5)
+        logger.log(title="second", model=FakeModel(), save_model=False)
+        logger.log(title="third", model=FakeModel(), save_model=False)
+
+        with self.subTest():
+            self.assertEqual(len(self.outbox()), 1)
+
+        backend.release.set()
+
+        with self.subTest():
+            self.assertTrue(logger.close(5))
+
+        with self.subTest():
+            self.assertEqual(backend.sent, ["first", "second", "third"])
+
+        with self.subTest():
+            self.assertIsNone(logger.worker)
+
+    def test_close_keeps_failed_logs(self):
+        logger = self.make_logger(FlakyBackend(failures=None))
+        logger.log(title="first", model=FakeModel(), save_model=False)
+
+        with self.subTest():
+            self.assertFalse(logger.close(5))
+
+        # Progress of the backend is stored with the payload (sent by the worker, then retried by close)
+        with open(os.path.join(self.outbox_dir.name, self.outbox()[0]), "rb") as f:
+            with self.subTest():
+                self.assertEqual(pickle.load(f)["sent"]["attempts"], 2)
+
+        # Outbox is sent by the next logger
+        backend = FlakyBackend()
+
+        with self.subTest():
+            self.assertTrue(self.make_logger(backend).flush(5))
+
+        with self.subTest():
+            self.assertEqual(backend.sent, ["first"])
+
+
+class FakeSpreadsheetService:
+    """
+    Keeps sheets of a spreadsheet, adding an existing sheet fails as in Google Sheets. The first "failures" value
+    writes fail.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.sheets = {}
+        self.request = None
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, **kwargs):
+        self.request = ("get", kwargs)
+        return self
+
+    def batchUpdate(self, **kwargs):
+        self.request = ("values" if "valueInputOption" in kwargs["body"] else "sheets", kwargs)
+        return self
+
+    def execute(self):
+        name, kwargs = self.request
+
+        if name == "get":
+            return {"sheets": [{"properties": {"sheetId": sheet_id, "title": title}}
+                               for sheet_id, title in self.sheets.items()]}
+
+        if name == "values":
+            if self.failures > 0:
+                self.failures -= 1
+                raise ValueError("Values could not be written")
+            return {}
+
+        # Requests of one batchUpdate are applied all or none
+        sheets = dict(self.sheets)
+        for request in kwargs["body"]["requests"]:
+            if "deleteSheet" in request:
+                del sheets[request["deleteSheet"]["sheetId"]]
+            elif "addSheet" in request:
+                properties = request["addSheet"]["properties"]
+                if properties["title"] in sheets.values():
+                    raise ValueError(f"Sheet {properties['title']} already exists")
+                sheets[properties["sheetId"]] = properties["title"]
+
+        self.sheets = sheets
+        return {}
+
+
+class FakeDrive:
+
+    def __init__(self):
+        self.uploads = 0
+
+    def upload_file(self, file_name, file_path, g_drive_url):
+        self.uploads += 1
+        return {"webViewLink": "link"}
+
+
+class GoogleBackendTester(unittest.TestCase):
+
+    def test_failed_send_is_repeated(self):
+        gs = GoogleSheets.__new__(GoogleSheets)
+        gs.service, gs.spreadsheet_id = FakeSpreadsheetService(failures=1), "sheet"
+        gs.endRowIndex, gs.pending_requests, gs.pending_values = 1, None, None
+
+        gd = FakeDrive()
+        backend = GoogleBackend(gd, gs)
+        payload = GoogleDriveLogger(backend=backend).prepare(title="test", model=FakeModel(), gd_folder_url="url")
+
+        # Sheets are created, data are not written
+        with self.subTest():
+            self.assertRaises(ValueError, backend.send, payload)
+
+        backend.send(payload)
+
+        with self.subTest():
+            self.assertEqual(sorted(gs.service.sheets.values()), ["test", "test => data"])
+
+        with self.subTest():
+            self.assertEqual(sorted(gs.service.sheets), sorted(payload["sent"]["sheet_ids"]))
+
+        with self.subTest():
+            self.assertEqual(gd.uploads, 1)
+
+
+class LocalBackendTester(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.runs_dir = os.path.join(self.directory.name, "runs")
+        self.model_path = os.path.join(self.directory.name, "best_model.h5")
+        with open(self.model_path, "wb") as f:
+            f.write(b"model")
+
+    def log(self, logger, title):
+        logger.log(title=title,
+                   model=FakeModel(),
+                   history={"loss": [0.7, 0.5], "val_loss": [0.8, 0.6]},
+                   saved_model_path=self.model_path,
+                   evaluation=evaluate_predictions(np.array([0, 0, 1, 1]), np.array([0.1, 0.6, 0.4, 0.9])))
+
+    def test_log_and_sync(self):
+        logger = GoogleDriveLogger(backend=LocalBackend(self.runs_dir))
+        self.log(logger, "first run")
+        self.log(logger, "second run")
+
+        runs = sorted(os.listdir(self.runs_dir))
+
+        with self.subTest():
+            self.assertEqual(len(runs), 2)
+
+        with self.subTest():
+            self.assertEqual(sorted(os.listdir(os.path.join(self.runs_dir, runs[0]))),
+                             ["history.csv", "history.png", "model.h5", "model_summary.txt", "payload.pkl",
+                              "roc.csv", "roc.png", "summary.csv"])
+
+        with open(os.path.join(self.runs_dir, runs[0], "model_summary.txt")) as f:
+            with self.subTest():
+                self.assertEqual(f.read(), "Model: fake\n")
+
+        # First run fails, second is synced
+        backend = FlakyBackend(failures=1)
+        synced, failed = sync(self.runs_dir, backend)
+
+        with self.subTest():
+            self.assertEqual((len(synced), len(failed)), (1, 1))
+
+        with open(backend.payloads[0]["saved_model_path"], "rb") as f:
+            with self.subTest():
+                self.assertEqual(f.read(), b"model")
+
+        # Only the failed run is synced again
+        synced, failed = sync(self.runs_dir, backend)
+
+        with self.subTest():
+            self.assertEqual((len(synced), len(failed)), (1, 0))
+
+        with self.subTest():
+            self.assertEqual(backend.sent, ["second run", "first run"])
 
-        self.assertEqual(True, True)
+        with self.subTest():
+            self.assertEqual(sync(self.runs_dir, backend), ([], []))
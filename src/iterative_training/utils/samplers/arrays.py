@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+
+
+class ChunkedArray:
+    """
+    Append-only array stored as a list of chunks. Appending a block of samples stores (a copy of) the block only,
+    already stored samples are never copied. Supports what data generators need - len, shape, dtype and indexing
+    by int, slice or array of indices (samples are gathered from the chunks directly into the output, slices are
+    taken from each chunk as views).
+    """
+
+    def __init__(self, chunks=(), directory=None):
+        """
+        :param chunks: iterable of ndarrays with the same trailing shape and dtype
+        :param directory: if set, each chunk is written to a .npy file in this directory and opened memory-mapped
+        """
+        self.directory = directory
+        self.chunks = []
+        self._ends_ = np.zeros(0, dtype=np.int64)
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        for chunk in chunks:
+            self.append(chunk, copy=False)
+
+    def append(self, x, copy=True):
+        """
+        Appends samples x (first axis) to the array.
+        :param copy: if False, x is stored without copying (it must not be modified afterwards)
+        """
+        x = np.asarray(x)
+
+        if self.chunks and (x.shape[1:] != self.shape[1:] or x.dtype != self.dtype):
+            raise ValueError(f"Cannot append samples of shape {x.shape[1:]} and type {x.dtype} to ChunkedArray "
+                             f"of shape {self.shape[1:]} and type {self.dtype}")
+
+        if self.chunks and len(x) == 0:
+            return
+
+        if self.directory is not None:
+            path = os.path.join(self.directory, f"chunk_{len(self.chunks):05d}.npy")
+            np.save(path, x)
+            x = np.load(path, mmap_mode="r")
+        elif copy:
+            x = x.copy()
+
+        self.chunks.append(x)
+        self._ends_ = np.append(self._ends_, len(self) + len(x))
+
+    def __len__(self):
+        return int(self._ends_[-1]) if len(self._ends_) else 0
+
+    @property
+    def shape(self):
+        return (len(self),) + self.chunks[0].shape[1:]
+
+    @property
+    def dtype(self):
+        return self.chunks[0].dtype
+
+    @property
+    def ndim(self):
+        return self.chunks[0].ndim
+
+    def _get_slice_(self, idx):
+        """
+        Returns samples selected by slice idx, as a view of the chunk if they are all in one chunk.
+        """
+        positions = range(*idx.indices(len(self)))
+
+        # Negative step => same positions gathered in increasing order and reversed
+        reverse = positions.step < 0
+        if reverse:
+            positions = positions[::-1]
+
+        parts = []
+        start, step = positions.start, positions.step
+        for chunk, end in zip(self.chunks, self._ends_):
+            chunk_start = int(end) - len(chunk)
+
+            # Positions of the slice falling into the chunk
+            first = max(0, -(-(chunk_start - start) // step))
+            last = min(len(positions), -(-(int(end) - start) // step))
+
+            if first < last:
+                parts.append(chunk[positions[first] - chunk_start:positions[last - 1] - chunk_start + 1:step])
+
+        if not parts:
+            out = self.chunks[0][:0]
+        else:
+            out = parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+        return out[::-1] if reverse else out
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self._get_slice_(idx)
+
+        if np.ndim(idx) == 0:
+            return self[np.array([idx])][0]
+
+        idx = np.asarray(idx, dtype=np.int64)
+        idx = np.where(idx < 0, idx + len(self), idx)
+
+        if len(idx) and (idx.min() < 0 or idx.max() >= len(self)):
+            raise IndexError(f"index out of range for ChunkedArray of length {len(self)}")
+
+        if len(self.chunks) == 1:
+            return self.chunks[0][idx]
+
+        # Group indices by chunk and gather each group at once
+        chunk_ids = np.searchsorted(self._ends_, idx, side="right")
+        order = np.argsort(chunk_ids, kind="stable")
+        bounds = np.searchsorted(chunk_ids[order], np.arange(len(self.chunks) + 1))
+        starts = self._ends_ - [len(chunk) for chunk in self.chunks]
+
+        out = np.empty((len(idx),) + self.shape[1:], dtype=self.dtype)
+        for i, chunk in enumerate(self.chunks):
+            selected = order[bounds[i]:bounds[i + 1]]
+            if len(selected):
+                out[selected] = chunk[idx[selected] - starts[i]]
+
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        x = np.concatenate(self.chunks) if len(self.chunks) > 1 else np.asarray(self.chunks[0])
+        return x if dtype is None else x.astype(dtype)
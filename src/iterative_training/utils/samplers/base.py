@@ -1,7 +1,16 @@
+import os
+import pickle
+import random
+import tempfile
+
 from sklearn.model_selection import train_test_split
 import numpy as np
+import pandas as pd
 
-from ..data_generators.base import BaseDataGenerator
+from ..data_generators.base import BaseDataGenerator, SequenceDataGenerator, make_tf_dataset
+from ..encoders.functions import compress_tensor, expand_tensor, encode_sequences, fits_tensor_dim
+from .arrays import ChunkedArray
+from .cache import DatasetCache
 
 
 class BaseSampler:
@@ -34,7 +43,8 @@ class BaseSampler:
         return "Sampler"
 
     def __init__(self, negative_ratio, positive_dataset,
-                 data_creator, encoder):
+                 data_creator, encoder, chunk_size=None, storage="float32", cache_dir=None, memmap_dir=None,
+                 split_mode="dataframe", split_seed=42):
         """
 
         :param negative_ratio:  either a fixed ratio or scheduler (function that gets iteration as input
@@ -42,6 +52,20 @@ class BaseSampler:
         :param positive_dataset: dataset with non encoded miRNA
         :param data_creator:  generator that takes in positive samples and returns negative ones
         :param encoder:     object able to encode miRNA / mRNA into "one-hot encoding"
+        :param chunk_size:  if set (and data_creator provides "iter_dataset"), datasets are created, split and
+            encoded chunk by chunk
+        :param storage:     how encoded datasets are held in memory - "float32", "uint8" or "packed" (bits),
+            batches are expanded to float32 by data generators. With "sequence" only nucleotide codes are
+            stored and watson-crick interaction matrices are created per batch (encoder's func is not used).
+        :param cache_dir:   if set, encoded datasets are cached in this directory and opened memory-mapped
+            when created from the same inputs again
+        :param memmap_dir:  if set, datasets which grow during training (training datasets) are stored as
+            memory-mapped chunks in this directory
+        :param split_mode:  how datasets are split into train, validation and test part
+            - dataframe - each dataset is split by train_test_split and every part is encoded separately
+            - index - all samples are encoded at once, ordered by split and class, so that all parts are views
+              into a single array (split is stratified by class and seeded by split_seed)
+        :param split_seed:  seed of the split in "index" mode
         """
 
         # TODO Pass kwargs to data_creator!
@@ -56,10 +80,24 @@ class BaseSampler:
 
         self.negative_ratio = negative_ratio
         self.current_negative_ratio = None
+        # Ratio negative datasets were created for (highest ratio so far, datasets never shrink)
+        self.created_negative_ratio = None
         self.positive_dataset = positive_dataset
+        self.chunk_size = chunk_size
+        self.storage = storage
+        self.cache = DatasetCache(cache_dir) if cache_dir is not None else None
+        self.memmap_dir = memmap_dir
+        self.split_mode = split_mode
+        self.split_seed = split_seed
+
+        # Data generators returned by get_data (updated in place in the following iterations)
+        self.datagens = None
 
         # Generate data, Encode datasets, ...
-        self.initialize()
+        try:
+            self.initialize()
+        finally:
+            self._release_encoder_()
 
     @staticmethod
     def _get_ratio_(ratio, iteration):
@@ -75,6 +113,166 @@ class BaseSampler:
         else:
             return ratio(iteration)
 
+    def _drop_long_sequences_(self, df):
+        """
+        Returns df without rows the encoder would skip (sequences longer than tensor_dim allows), so that encoded
+        datasets stay aligned with the non encoded ones.
+        """
+        keep = fits_tensor_dim(df, self.encoder.tensor_dim)
+
+        if keep.all():
+            return df
+
+        print(f"⚠️ {np.count_nonzero(~keep)} samples dropped, sequences longer than {self.encoder.tensor_dim[:2]}")
+        return df[keep]
+
+    def _encode_(self, df):
+        """
+        Encodes df and converts it to the storage format of the sampler.
+        """
+        if self.storage == "sequence":
+            encoded = encode_sequences(df, self.encoder.tensor_dim)
+        else:
+            encoded = compress_tensor(self.encoder.encode(df), self.storage)
+
+        if len(encoded) != len(df):
+            raise ValueError(f"Encoder skipped {len(df) - len(encoded)} of {len(df)} samples, "
+                             f"encoded and non encoded datasets would not be aligned")
+
+        return encoded
+
+    def _release_encoder_(self):
+        """
+        Stops worker processes of the encoder (they are only needed while datasets are encoded and are started
+        again by the next encode call).
+        """
+        close = getattr(self.encoder, "close", None)
+        if close is not None:
+            close()
+
+    def expand(self, x):
+        """
+        Converts stored samples (e.g. self.test_p) to float32 tensors accepted by the model.
+        """
+        return expand_tensor(x, self.storage, self.encoder.tensor_dim)
+
+    @staticmethod
+    def _split_indices_(num_samples, seed):
+        """
+        Randomly splits indices into train, validation and test part (same proportions as in "initialize").
+        :param num_samples: int
+        :param seed: seed of the permutation
+        :return: train, val, test ndarrays of indices
+        """
+        permutation = np.random.default_rng(seed).permutation(num_samples)
+
+        num_test = int(np.ceil(0.2 * num_samples))
+        num_val = int(np.ceil(0.1 * (num_samples - num_test)))
+
+        return permutation[num_test + num_val:], permutation[num_test:num_test + num_val], permutation[:num_test]
+
+    def _split_chunk_(self, df, seed):
+        """
+        Splits chunk of data into train, validation and test part (same proportions as in "initialize").
+        Works for chunks of any size.
+        :param df: pandas DataFrame
+        :param seed: seed of the permutation
+        :return: train, val, test DataFrames
+        """
+        return tuple(df.iloc[idx] for idx in self._split_indices_(len(df), seed))
+
+    def _initialize_indexed_(self, positive_data, negative_data):
+        """
+        Splits datasets by indices. Samples are ordered by split and class (train_p, train_n, val_p, ...) and encoded
+        at once, every part of the datasets is a view into the encoded array.
+        """
+        data = pd.concat((positive_data, negative_data), ignore_index=True)
+
+        # Stratified split - each class is split separately
+        rng = np.random.default_rng(self.split_seed)
+        positive_parts = self._split_indices_(len(positive_data), rng.integers(2 ** 63))
+        negative_parts = self._split_indices_(len(negative_data), rng.integers(2 ** 63))
+
+        parts = {}
+        for split, positive_idx, negative_idx in zip(("train", "val", "test"), positive_parts, negative_parts):
+            parts[f"{split}_p"] = positive_idx
+            parts[f"{split}_n"] = negative_idx + len(positive_data)
+
+        data = data.iloc[np.concatenate(list(parts.values()))].reset_index(drop=True)
+        encoded = self._encode_(data)
+
+        start = 0
+        for split, idx in parts.items():
+            setattr(self, f"{split}_ne", data.iloc[start:start + len(idx)])
+            setattr(self, split, encoded[start:start + len(idx)])
+            start += len(idx)
+
+    def _initialize_chunked_(self):
+        """
+        Creates datasets lazily with data_creator.iter_dataset. Each chunk is split and encoded right away,
+        so the whole non encoded dataset is never encoded at once.
+        """
+        datasets = {
+            "p": self.creator.iter_dataset(mirna_df=self.positive_dataset,
+                                           chunk_size=self.chunk_size,
+                                           mutation_mode="positive_class"),
+            "n": self.creator.iter_dataset(mirna_df=self.positive_dataset,
+                                           chunk_size=self.chunk_size,
+                                           n=self.current_negative_ratio,
+                                           mutation_mode="negative_class")
+        }
+
+        for label, chunks in datasets.items():
+            parts = {"train": ([], []), "val": ([], []), "test": ([], [])}
+            empty = None
+
+            for i, chunk in enumerate(chunks):
+                chunk = self._drop_long_sequences_(chunk)
+                empty = chunk.iloc[:0]
+                for split, df in zip(parts.keys(), self._split_chunk_(chunk, seed=42 + i)):
+                    if len(df):
+                        parts[split][0].append(df)
+                        parts[split][1].append(self._encode_(df))
+
+            for split, (raw, encoded) in parts.items():
+                # With small chunks a split may get no samples
+                if not raw:
+                    raw, encoded = [empty], [self._encode_(empty)]
+
+                setattr(self, f"{split}_{label}_ne", pd.concat(raw))
+                setattr(self, f"{split}_{label}", np.concatenate(encoded, axis=0))
+
+    def _get_cache_key_(self):
+        """
+        Returns hash of everything the datasets are created from.
+        """
+        return self.cache.get_key(self.positive_dataset,
+                                  negative_ratio=self.current_negative_ratio,
+                                  creator=self.cache.describe(self.creator),
+                                  encoder={"func": self.cache.describe(self.encoder).get("func"),
+                                           "tensor_dim": self.encoder.tensor_dim},
+                                  chunk_size=self.chunk_size,
+                                  storage=self.storage,
+                                  split_mode=self.split_mode,
+                                  split_seed=self.split_seed)
+
+    def _load_cached_(self, key):
+        """
+        Sets datasets from cache (encoded arrays are memory-mapped).
+        :return: True if datasets were found in cache
+        """
+        cached = self.cache.load(key)
+
+        if cached is None:
+            return False
+
+        encoded, raw = cached
+        for split in self.cache.splits:
+            setattr(self, split, encoded[split])
+            setattr(self, f"{split}_ne", raw[split])
+
+        return True
+
     def initialize(self):
         """
         Split data and prepare the first data encoding.
@@ -82,17 +280,39 @@ class BaseSampler:
         """
 
         self.current_negative_ratio = self._get_ratio_(self.negative_ratio, 0)
+        self.created_negative_ratio = self.current_negative_ratio
 
         # ------------------------------------------------------
         # Initial initialization
 
-        if self.train_p_ne is None:
+        cache_key = None
+        if self.train_p_ne is None and self.cache is not None:
+            cache_key = self._get_cache_key_()
+
+            if self._load_cached_(cache_key):
+                self._make_growable_()
+                print("✅ sampler loaded from cache")
+                return
+
+        if self.train_p_ne is None and self.chunk_size is not None and hasattr(self.creator, "iter_dataset"):
+            self._initialize_chunked_()
+            print("✅ sampler initialized")
+
+        elif self.train_p_ne is None:
             positive_data = self.creator.make_dataset(mirna_df=self.positive_dataset,
                                                       mutation_mode="positive_class")
             negative_data = self.creator.make_dataset(mirna_df=self.positive_dataset,
                                                       n=self.current_negative_ratio,
                                                       mutation_mode="negative_class")
 
+            positive_data = self._drop_long_sequences_(positive_data)
+            negative_data = self._drop_long_sequences_(negative_data)
+
+        if self.train_p_ne is None and self.split_mode == "index":
+            self._initialize_indexed_(positive_data, negative_data)
+            print("✅ sampler initialized")
+
+        elif self.train_p_ne is None:
             self.train_p_ne, self.test_p_ne = train_test_split(positive_data,
                                                                test_size=0.2,
                                                                random_state=42)
@@ -109,46 +329,298 @@ class BaseSampler:
                                                               test_size=0.1,
                                                               random_state=42)
             # Encode data
-            self.train_p = self.encoder.encode(self.train_p_ne)
-            self.train_n = self.encoder.encode(self.train_n_ne)
+            self.train_p = self._encode_(self.train_p_ne)
+            self.train_n = self._encode_(self.train_n_ne)
 
             # print(f"✅ 1/3 \t training dataset encoded \t shape positive: {self.train_p.shape} \t shape negative: {self.train_n.shape}")
             
-            self.val_p = self.encoder.encode(self.val_p_ne)
-            self.val_n = self.encoder.encode(self.val_n_ne)
+            self.val_p = self._encode_(self.val_p_ne)
+            self.val_n = self._encode_(self.val_n_ne)
 
             # print(f"✅ 2/3 \t validation dataset encoded \t shape positive: {self.val_p.shape} \t shape negative: {self.val_n.shape}")
 
-            self.test_p = self.encoder.encode(self.test_p_ne)
-            self.test_n = self.encoder.encode(self.test_n_ne)
+            self.test_p = self._encode_(self.test_p_ne)
+            self.test_n = self._encode_(self.test_n_ne)
 
             # print(f"✅ 3/3 \t validation dataset encoded \t shape positive: {self.val_p.shape} \t shape negative: {self.val_n.shape}")
 
             print("✅ sampler initialized")
 
-    def on_training_end(self, model):
+        if cache_key is not None:
+            self.cache.store(cache_key,
+                             encoded={split: getattr(self, split) for split in self.cache.splits},
+                             raw={split: getattr(self, f"{split}_ne") for split in self.cache.splits})
+
+            # Replace arrays in memory with memory-mapped ones
+            self._load_cached_(cache_key)
+
+        self._make_growable_()
+
+    def _make_growable_(self):
+        """
+        Converts training datasets to ChunkedArrays, so that new samples can be appended
+        without copying the whole datasets.
+        """
+        if self.memmap_dir is not None:
+            os.makedirs(self.memmap_dir, exist_ok=True)
+
+        for split in ("train_p", "train_n"):
+            x = getattr(self, split)
+
+            if not isinstance(x, ChunkedArray):
+                directory = None if self.memmap_dir is None else tempfile.mkdtemp(prefix=f"{split}_",
+                                                                                   dir=self.memmap_dir)
+                setattr(self, split, ChunkedArray([x], directory=directory))
+
+    def save_state(self, path):
+        """
+        Stores current datasets, negative ratio and random state (of data creator and global generators) to
+        directory path, so that iterative training can be resumed (see load_state).
+        :param path: str => directory
+        """
+        DatasetCache.write(path,
+                           encoded={split: getattr(self, split) for split in DatasetCache.splits},
+                           raw={split: getattr(self, f"{split}_ne") for split in DatasetCache.splits})
+
+        creator_rng = getattr(self.creator, "rng", None)
+        state = {
+            "current_negative_ratio": self.current_negative_ratio,
+            "created_negative_ratio": self.created_negative_ratio,
+            "creator_rng": creator_rng.bit_generator.state if isinstance(creator_rng, np.random.Generator) else None,
+            "numpy_rng": np.random.get_state(),
+            "python_rng": random.getstate()
+        }
+
+        with open(os.path.join(path, "sampler_state.pkl"), "wb") as f:
+            pickle.dump(state, f)
+
+    def load_state(self, path):
+        """
+        Restores state stored by save_state.
+        :param path: str => directory
+        """
+        encoded, raw = DatasetCache.read(path, mmap_mode=None)
+        for split in DatasetCache.splits:
+            setattr(self, split, encoded[split])
+            setattr(self, f"{split}_ne", raw[split])
+
+        self._make_growable_()
+
+        with open(os.path.join(path, "sampler_state.pkl"), "rb") as f:
+            state = pickle.load(f)
+
+        self.current_negative_ratio = state["current_negative_ratio"]
+        self.created_negative_ratio = state["created_negative_ratio"]
+        if state["creator_rng"] is not None:
+            self.creator.rng.bit_generator.state = state["creator_rng"]
+        np.random.set_state(state["numpy_rng"])
+        random.setstate(state["python_rng"])
+
+    def set_negative_ratio(self, negative_ratio):
+        """
+        Sets current negative ratio. If it is higher than the ratio datasets were created with, only the missing
+        negative samples are created. They are added to training data only - validation and test datasets stay the
+        same, so that val_loss and test results of all iterations are comparable.
+        :param negative_ratio: int => number of negative samples per miRNA
+        """
+        missing = negative_ratio - self.created_negative_ratio
+
+        if missing > 0:
+            negative_data = self._drop_long_sequences_(self.creator.make_dataset(mirna_df=self.positive_dataset,
+                                                                                 n=missing,
+                                                                                 mutation_mode="negative_class"))
+
+            try:
+                self.train_n.append(self._encode_(negative_data))
+            finally:
+                self._release_encoder_()
+
+            self.train_n_ne = pd.concat((self.train_n_ne, negative_data), ignore_index=True)
+
+            print(f"✅ {len(negative_data)} negatives created for ratio 1:{negative_ratio}")
+            self.created_negative_ratio = negative_ratio
+
+        self.current_negative_ratio = negative_ratio
+
+    def on_training_end(self, model, batch_size, iteration, test_datagen):
         """
         Evaluate current model and decide which data should be used in the next iteration.
-        This function should be implemented in each experiment.
+        This function should be implemented in each experiment (by default only the negative ratio
+        of the next iteration is applied).
         :param model: current best model
-        :return:
+        :param batch_size: int
+        :param iteration: int => index of the finished iteration
+        :param test_datagen: test data generator
+        :return: train, valid data generators for the next iteration
         """
 
-        pass
+        self.set_negative_ratio(self._get_ratio_(self.negative_ratio, iteration + 1))
+
+        train_datagen, val_datagen, _ = self.get_data(batch_size)
+        return train_datagen, val_datagen
+
+    def _get_datagen_(self, x_positive, x_negative, class_ratio, batch_size, shuffle=True):
+        y_positive, y_negative = np.ones(len(x_positive)), np.zeros(len(x_negative))
+
+        if self.storage == "sequence":
+            return SequenceDataGenerator(x_positive, y_positive, x_negative, y_negative,
+                                         class_ratio, batch_size, tensor_dim=self.encoder.tensor_dim,
+                                         shuffle=shuffle)
+
+        return BaseDataGenerator(x_positive, y_positive, x_negative, y_negative,
+                                 class_ratio, batch_size, transform=self.expand, shuffle=shuffle)
 
     def get_data(self, batch_size=256):
-        # Return data generators => train, valid, test
-        # TODO: zmenit na dynamicke menenie ratia (ak je definovane)
+        """
+        Returns data generators => train, valid, test. Generators are created once (for a batch size) and then
+        only updated in place with current datasets and negative ratio.
+        """
+        class_ratio = (1, self.current_negative_ratio)
+        splits = [(self.train_p, self.train_n), (self.val_p, self.val_n), (self.test_p, self.test_n)]
+
+        if self.datagens is None or self.datagens[0].batch_size != batch_size:
+            self.datagens = tuple(self._get_datagen_(x_positive, x_negative, class_ratio, batch_size, shuffle=i == 0)
+                                  for i, (x_positive, x_negative) in enumerate(splits))
+        else:
+            for datagen, (x_positive, x_negative) in zip(self.datagens, splits):
+                datagen.set_data(x_positive, np.ones(len(x_positive)), x_negative, np.zeros(len(x_negative)))
+                datagen.set_class_ratio(class_ratio)
+
+        return self.datagens
+
+    def get_tf_datasets(self, batch_size=256, cache=True, seed=None):
+        """
+        Returns tf.data pipelines => train, valid, test (see data_generators.base.make_tf_dataset).
+        Datasets are created from arrays held by the sampler, so they have to fit into a TensorFlow tensor.
+
+        :param batch_size: int
+        :param cache: bool => cache expanded validation and test batches
+        :param seed: seed used for shuffling and class sampling of the training data
+        :return: train, valid, test tf.data.Dataset
+        """
         class_ratio = (1, self.current_negative_ratio)
+        kwargs = dict(storage=self.storage, tensor_dim=self.encoder.tensor_dim)
+
+        train_dataset = make_tf_dataset(self.train_p, self.train_n, class_ratio, batch_size,
+                                        training=True, seed=seed, **kwargs)
+        val_dataset = make_tf_dataset(self.val_p, self.val_n, class_ratio, batch_size,
+                                      training=False, cache=cache, **kwargs)
+        test_dataset = make_tf_dataset(self.test_p, self.test_n, class_ratio, batch_size,
+                                       training=False, cache=cache, **kwargs)
+
+        return train_dataset, val_dataset, test_dataset
+
+
+class UncertaintySampler(BaseSampler):
+    """
+    After each iteration, a pool of new negative candidates is created by the data creator, scored by the current
+    best model and the top "num_samples" of them are added to the training negatives:
+        - uncertain - candidates with prediction closest to 0.5
+        - hardest - candidates with the highest prediction (false positives)
+
+    The pool is created, encoded and scored chunk by chunk and only the best candidates so far are kept,
+    so memory use does not depend on the pool size.
+    """
+
+    strategies = ("uncertain", "hardest")
+
+    @staticmethod
+    def __name__():
+        return "UncertaintySampler"
+
+    def __init__(self, negative_ratio, positive_dataset, data_creator, encoder,
+                 num_samples=1000, pool_ratio=10, strategy="uncertain", pool_chunk_size=100000, **kwargs):
+        """
+        :param num_samples: int => number of negatives added to training data after each iteration
+        :param pool_ratio: int => number of candidates created for each miRNA of positive_dataset
+        :param strategy: "uncertain" or "hardest"
+        :param pool_chunk_size: int => number of candidates created and encoded at once
+        :param kwargs: see BaseSampler
+        """
+        if strategy not in self.strategies:
+            raise ValueError(f"strategy has to be one of {self.strategies}, got {strategy}")
+
+        self.num_samples = num_samples
+        self.pool_ratio = pool_ratio
+        self.strategy = strategy
+        self.pool_chunk_size = pool_chunk_size
+
+        super(UncertaintySampler, self).__init__(negative_ratio, positive_dataset, data_creator, encoder, **kwargs)
+
+    def _iter_pool_(self):
+        """
+        Yields chunks of non encoded candidates.
+        """
+        kwargs = dict(mirna_df=self.positive_dataset, n=self.pool_ratio, mutation_mode="negative_class")
+
+        if hasattr(self.creator, "iter_dataset"):
+            yield from self.creator.iter_dataset(chunk_size=self.pool_chunk_size, **kwargs)
+        else:
+            pool = self.creator.make_dataset(**kwargs)
+            for start in range(0, len(pool), self.pool_chunk_size):
+                yield pool.iloc[start:start + self.pool_chunk_size]
+
+    def predict(self, model, x, batch_size):
+        """
+        Predicts stored samples batch by batch (only a single batch is expanded to float32 at once).
+        :return: ndarray of shape (len(x),)
+        """
+        predictions = np.empty(len(x), dtype=np.float32)
+
+        for start in range(0, len(x), batch_size):
+            batch = self.expand(x[start:start + batch_size])
+            predictions[start:start + batch_size] = np.asarray(model.predict_on_batch(batch)).reshape(-1)
+
+        return predictions
+
+    def score(self, predictions):
+        """
+        Returns scores of candidates, the higher the score the more valuable candidate is.
+        """
+        if self.strategy == "uncertain":
+            return -np.abs(predictions - 0.5)
+
+        return predictions
+
+    def select(self, model, batch_size):
+        """
+        Scores the candidate pool and returns the best "num_samples" candidates.
+        :return: (encoded candidates, non encoded candidates)
+        """
+        best_scores, best_x, best_ne = np.empty(0, dtype=np.float32), None, None
+
+        for chunk in self._iter_pool_():
+            chunk = self._drop_long_sequences_(chunk).reset_index(drop=True)
+            x = self._encode_(chunk)
+            scores = self.score(self.predict(model, x, batch_size))
+
+            if best_x is not None:
+                scores = np.concatenate((best_scores, scores))
+                x = np.concatenate((best_x, x))
+                chunk = pd.concat((best_ne, chunk), ignore_index=True)
+
+            # Keep top k of the candidates so far
+            if len(scores) > self.num_samples:
+                keep = np.argpartition(scores, len(scores) - self.num_samples)[-self.num_samples:]
+                scores, x, chunk = scores[keep], x[keep], chunk.iloc[keep].reset_index(drop=True)
+
+            best_scores, best_x, best_ne = scores, x, chunk
+
+        return best_x, best_ne
+
+    def on_training_end(self, model, batch_size, iteration, test_datagen):
+        """
+        Adds the selected candidates to training negatives.
+        """
+        try:
+            x, x_ne = self.select(model, batch_size)
+        finally:
+            self._release_encoder_()
+
+        if x is not None:
+            self.train_n.append(x)
+            self.train_n_ne = pd.concat((self.train_n_ne, x_ne), ignore_index=True)
+
+            print(f"✅ {len(x)} {self.strategy} negatives added \t training negatives: {len(self.train_n)}")
 
-        train_datagen = BaseDataGenerator(self.train_p, np.ones(len(self.train_p)),
-                                          self.train_n, np.zeros(len(self.train_n)),
-                                          class_ratio, batch_size)
-        val_datagen = BaseDataGenerator(self.val_p, np.ones(len(self.val_p)),
-                                        self.val_n, np.zeros(len(self.val_n)),
-                                        class_ratio, batch_size)
-        test_datagen = BaseDataGenerator(self.test_p, np.ones(len(self.test_p)),
-                                         self.test_n, np.zeros(len(self.test_n)),
-                                         class_ratio, batch_size)
-
-        return train_datagen, val_datagen, test_datagen
+        return super(UncertaintySampler, self).on_training_end(model, batch_size, iteration, test_datagen)
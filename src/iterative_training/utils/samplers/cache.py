@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+
+class DatasetCache:
+    """
+    On-disk cache of encoded datasets. Each split is stored as a .npy file in a directory named by a hash
+    of all inputs the datasets were created from, so the arrays can be opened memory-mapped (and shared
+    by several processes) on a cache hit.
+    """
+
+    splits = ("train_p", "train_n", "val_p", "val_n", "test_p", "test_n")
+
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: str => directory where cached datasets are stored
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def describe(obj):
+        """
+        Returns JSON serializable description of an object (class name and its simple attributes, state of
+        numpy random generator) used as a part of cache key.
+        """
+        description = {"class": f"{type(obj).__module__}.{type(obj).__qualname__}"}
+
+        for name, value in vars(obj).items():
+            if isinstance(value, np.random.Generator):
+                description[name] = value.bit_generator.state
+            elif isinstance(value, (int, float, str, bool, tuple, list, type(None))):
+                description[name] = value
+            elif callable(value):
+                description[name] = f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', '')}"
+
+        return description
+
+    @staticmethod
+    def get_key(df, **config):
+        """
+        Returns hash of DataFrame contents and configuration.
+        :param df: pandas DataFrame
+        :param config: JSON serializable configuration
+        :return: str
+        """
+        h = hashlib.sha256()
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        h.update(json.dumps(config, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def _get_path_(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key, mmap_mode="r"):
+        """
+        Loads cached datasets.
+        :param key: cache key (see get_key)
+        :param mmap_mode: passed to numpy.load
+        :return: (dict of encoded arrays, dict of non encoded DataFrames) or None if key is not cached
+        """
+        path = self._get_path_(key)
+
+        if not os.path.isdir(path):
+            return None
+
+        return self.read(path, mmap_mode=mmap_mode)
+
+    def store(self, key, encoded, raw):
+        """
+        Stores datasets. Files are written to a temporary directory which is renamed when complete, so
+        a partially written cache entry is never loaded.
+        :param key: cache key (see get_key)
+        :param encoded: dict split name => encoded ndarray
+        :param raw: dict split name => non encoded DataFrame
+        """
+        path = self._get_path_(key)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+
+        self.write(tmp_path, encoded, raw)
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Stored by another process in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @classmethod
+    def write(cls, path, encoded, raw):
+        """
+        Writes datasets to directory path (.npy file and .csv file per split).
+        :param path: str => directory (created if needed)
+        :param encoded: dict split name => encoded ndarray
+        :param raw: dict split name => non encoded DataFrame
+        """
+        os.makedirs(path, exist_ok=True)
+
+        for split in cls.splits:
+            np.save(os.path.join(path, f"{split}.npy"), np.asarray(encoded[split]))
+            raw[split].to_csv(os.path.join(path, f"{split}_ne.csv"), index=False)
+
+    @classmethod
+    def read(cls, path, mmap_mode="r"):
+        """
+        Reads datasets written by write.
+        :return: (dict of encoded arrays, dict of non encoded DataFrames)
+        """
+        encoded = {split: np.load(os.path.join(path, f"{split}.npy"), mmap_mode=mmap_mode)
+                   for split in cls.splits}
+        raw = {split: pd.read_csv(os.path.join(path, f"{split}_ne.csv")) for split in cls.splits}
+
+        return encoded, raw
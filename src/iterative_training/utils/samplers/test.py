@@ -0,0 +1,258 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from .arrays import ChunkedArray
+from .base import BaseSampler, UncertaintySampler
+from ..data_generators.base import VectorizedDataCreator
+from ..encoders.base import BaseEncoder, VectorizedEncoder
+
+
+class MeanModel:
+
+    @staticmethod
+    def predict_on_batch(x):
+        return x.mean(axis=(1, 2, 3))
+
+
+class SamplerTester(unittest.TestCase):
+
+    df_mirna = pd.DataFrame(data={
+        "Mature sequence": ["UGAGGUAGUAGGUUGUAUAGUU", "UAGCAGCACGUAAAUAUUGGCG", "AAAGUGCUUACAGUGCAGGUAG",
+                            "UGGAAUGUAAAGAAGUAUGUAU", "UAAAGUGCUUAUAGUGCAGGUA", "UUCAAGUAAUCCAGGAUAGGCU"] * 5
+    })
+
+    def make_sampler(self, **kwargs):
+        return BaseSampler(2, self.df_mirna, VectorizedDataCreator(rng=0), VectorizedEncoder(), **kwargs)
+
+    def test_cached_datasets(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            sampler = self.make_sampler(cache_dir=cache_dir, storage="packed")
+            cached_sampler = self.make_sampler(cache_dir=cache_dir, storage="packed")
+
+            with self.subTest():
+                self.assertIsInstance(cached_sampler.test_p, np.memmap)
+
+            for split in ["train_p", "train_n", "val_p", "val_n", "test_p", "test_n"]:
+                with self.subTest(split=split):
+                    np.testing.assert_array_equal(getattr(sampler, split), getattr(cached_sampler, split))
+
+            # Different configuration => different cache entry
+            with self.subTest():
+                self.assertEqual(self.make_sampler(cache_dir=cache_dir).train_n.dtype, np.float32)
+
+    def test_tf_datasets(self):
+        sampler = self.make_sampler(storage="packed")
+        train_dataset, val_dataset, _ = sampler.get_tf_datasets(batch_size=16, seed=0)
+
+        val_x = np.concatenate([x.numpy() for x, _ in val_dataset])
+        train_y = np.concatenate([y.numpy() for _, y in train_dataset])
+
+        with self.subTest():
+            np.testing.assert_array_equal(val_x, sampler.expand(np.concatenate([sampler.val_p, sampler.val_n])))
+
+        # Every negative sample once per epoch on average, positives drawn with 1:2 ratio
+        with self.subTest():
+            self.assertEqual(len(train_y), int(np.ceil(len(sampler.train_n) * 1.5)))
+
+    def test_save_and_load_state(self):
+        sampler = self.make_sampler(storage="packed")
+        sampler.current_negative_ratio, sampler.created_negative_ratio = 3, 4
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            sampler.save_state(state_dir)
+            expected = sampler.creator.rng.random()
+
+            restored = self.make_sampler(storage="packed")
+            restored.creator.rng = np.random.default_rng(1)
+            restored.load_state(state_dir)
+
+        with self.subTest():
+            self.assertEqual((restored.current_negative_ratio, restored.created_negative_ratio), (3, 4))
+
+        with self.subTest():
+            self.assertEqual(restored.creator.rng.random(), expected)
+
+        for split in ["train_p", "train_n", "val_p", "val_n", "test_p", "test_n"]:
+            with self.subTest(split=split):
+                np.testing.assert_array_equal(getattr(sampler, split), getattr(restored, split))
+
+    def test_uncertainty_sampler(self):
+        sampler = UncertaintySampler(2, self.df_mirna, VectorizedDataCreator(rng=0, block_size=4), VectorizedEncoder(),
+                                     num_samples=10, pool_ratio=3, pool_chunk_size=12, storage="packed")
+        num_negatives = len(sampler.train_n)
+        rng_state = sampler.creator.rng.bit_generator.state
+
+        sampler.on_training_end(MeanModel(), 8, 0, None)
+
+        # Top k of the whole pool at once
+        sampler.creator.rng.bit_generator.state = rng_state
+        pool = pd.concat(sampler._iter_pool_())
+        scores = sampler.score(sampler.predict(MeanModel(), sampler._encode_(pool), 8))
+
+        with self.subTest():
+            self.assertEqual(len(sampler.train_n), num_negatives + 10)
+
+        with self.subTest():
+            np.testing.assert_allclose(np.sort(sampler.score(sampler.predict(MeanModel(), sampler.train_n[-10:], 8))),
+                                       np.sort(scores)[-10:])
+
+    def test_uncertainty_sampler_long_sequences(self):
+        sampler = UncertaintySampler(2, self.df_mirna, VectorizedDataCreator(rng=0), VectorizedEncoder(),
+                                     num_samples=10, pool_ratio=3, pool_chunk_size=12, storage="uint8")
+        iter_pool = sampler._iter_pool_
+
+        # Some candidates cannot be encoded
+        def iter_pool_with_long_sequences():
+            for chunk in iter_pool():
+                chunk = chunk.copy()
+                chunk.loc[chunk.index[::3], "mrna"] += "A" * 10
+                yield chunk
+
+        sampler._iter_pool_ = iter_pool_with_long_sequences
+        x, x_ne = sampler.select(MeanModel(), 8)
+
+        with self.subTest():
+            self.assertEqual(len(x), 10)
+
+        with self.subTest():
+            np.testing.assert_array_equal(x, sampler._encode_(x_ne))
+
+    def test_chunked_array(self):
+        x = np.arange(60, dtype=np.uint8).reshape(20, 3)
+        idx = np.random.default_rng(0).permutation(20)[:15]
+
+        with tempfile.TemporaryDirectory() as directory:
+            for chunked in [ChunkedArray([x[:7]]), ChunkedArray([x[:7]], directory=directory)]:
+                chunked.append(x[7:8])
+                chunked.append(x[8:])
+
+                with self.subTest(directory=chunked.directory):
+                    self.assertEqual(chunked.shape, x.shape)
+
+                with self.subTest(directory=chunked.directory):
+                    np.testing.assert_array_equal(chunked[idx], x[idx])
+
+                for idx_slice in [slice(5, 12), slice(None, None, 3), slice(-2, 3, -4), slice(15, 2), slice(-100, 100)]:
+                    with self.subTest(directory=chunked.directory, idx_slice=idx_slice):
+                        np.testing.assert_array_equal(chunked[idx_slice], x[idx_slice])
+
+                # Slice within one chunk is a view
+                with self.subTest(directory=chunked.directory):
+                    self.assertTrue(np.shares_memory(chunked[1:6], chunked.chunks[0]))
+
+                with self.subTest(directory=chunked.directory):
+                    np.testing.assert_array_equal(chunked[-1], x[-1])
+
+                with self.subTest(directory=chunked.directory):
+                    np.testing.assert_array_equal(np.asarray(chunked), x)
+
+    def test_negative_ratio_schedule(self):
+        sampler = BaseSampler(lambda iteration: 1 + iteration, self.df_mirna, VectorizedDataCreator(rng=0),
+                              VectorizedEncoder(), storage="packed")
+        train_datagen, _, test_datagen = sampler.get_data(batch_size=12)
+        num_negatives = len(sampler.train_n) + len(sampler.val_n) + len(sampler.test_n)
+        num_train_negatives = len(sampler.train_n)
+
+        new_train_datagen, _ = sampler.on_training_end(None, 12, 0, test_datagen)
+
+        with self.subTest():
+            self.assertIs(new_train_datagen, train_datagen)
+
+        with self.subTest():
+            self.assertEqual(len(sampler.train_n) + len(sampler.val_n) + len(sampler.test_n), 2 * num_negatives)
+
+        # New negatives are only used for training
+        with self.subTest():
+            self.assertEqual(len(sampler.val_n) + len(sampler.test_n), num_negatives - num_train_negatives)
+
+        with self.subTest():
+            self.assertEqual(len(sampler.train_n_ne), len(sampler.train_n))
+
+        with self.subTest():
+            self.assertEqual(len(sampler.test_n_ne), len(sampler.test_n))
+
+        with self.subTest():
+            self.assertEqual((train_datagen.positive_in_batch, train_datagen.negative_in_batch), (4, 8))
+
+        with self.subTest():
+            self.assertEqual(len(test_datagen.y_negative), len(sampler.test_n))
+
+    def test_lowered_negative_ratio(self):
+        sampler = BaseSampler(lambda iteration: [4, 2, 4][iteration], self.df_mirna, VectorizedDataCreator(rng=0),
+                              VectorizedEncoder(), storage="packed")
+        _, _, test_datagen = sampler.get_data(batch_size=12)
+        num_negatives = len(sampler.train_n) + len(sampler.val_n) + len(sampler.test_n)
+
+        # Negatives created for 1:4 are kept when the ratio goes down and reused when it goes up again
+        for iteration in range(2):
+            sampler.on_training_end(None, 12, iteration, test_datagen)
+
+            with self.subTest(iteration=iteration):
+                self.assertEqual(len(sampler.train_n) + len(sampler.val_n) + len(sampler.test_n), num_negatives)
+
+        with self.subTest():
+            self.assertEqual((sampler.current_negative_ratio, sampler.created_negative_ratio), (4, 4))
+
+    def test_long_sequences_are_dropped(self):
+        class LongSequenceCreator(VectorizedDataCreator):
+            def make_dataset(self, **kwargs):
+                df = super(LongSequenceCreator, self).make_dataset(**kwargs)
+                df.loc[df.index[::7], "mrna"] += "A" * 10
+                return df
+
+        for split_mode in ["dataframe", "index"]:
+            sampler = BaseSampler(2, self.df_mirna, LongSequenceCreator(rng=0), VectorizedEncoder(), storage="uint8",
+                                  split_mode=split_mode)
+
+            for split in ["train_p", "train_n", "val_p", "val_n", "test_p", "test_n"]:
+                with self.subTest(split_mode=split_mode, split=split):
+                    np.testing.assert_array_equal(getattr(sampler, split),
+                                                  sampler._encode_(getattr(sampler, f"{split}_ne")))
+
+    def test_small_chunks(self):
+        # Chunks of a single sample are all split to the test set
+        sampler = BaseSampler(1, self.df_mirna.iloc[:3], VectorizedDataCreator(rng=0, block_size=1),
+                              VectorizedEncoder(), chunk_size=1, storage="packed")
+
+        with self.subTest():
+            self.assertEqual((len(sampler.train_p), len(sampler.val_p), len(sampler.test_p)), (0, 0, 3))
+
+        with self.subTest():
+            self.assertEqual((len(sampler.train_p_ne), sampler.train_p.shape[1:]), (0, sampler.test_p.shape[1:]))
+
+    def test_encoder_pool_is_released(self):
+        encoder = BaseEncoder(processes=2, chunk_size=16)
+        sampler = BaseSampler(2, self.df_mirna, VectorizedDataCreator(rng=0), encoder, storage="packed")
+
+        with self.subTest():
+            self.assertIsNone(encoder.pool)
+
+        sampler.set_negative_ratio(3)
+
+        with self.subTest():
+            self.assertIsNone(encoder.pool)
+
+    def test_index_split(self):
+        sampler = self.make_sampler(split_mode="index", storage="uint8")
+        same_sampler = self.make_sampler(split_mode="index", storage="uint8")
+
+        with self.subTest():
+            self.assertIs(sampler.train_p.chunks[0].base, sampler.test_n.base)
+
+        # Stratified split of 30 positive and 60 negative samples
+        with self.subTest():
+            self.assertEqual([len(getattr(sampler, split)) for split in ["train_p", "val_p", "test_p"]], [21, 3, 6])
+
+        with self.subTest():
+            self.assertEqual([len(getattr(sampler, split)) for split in ["train_n", "val_n", "test_n"]], [43, 5, 12])
+
+        for split in ["train_p", "train_n", "val_p", "val_n", "test_p", "test_n"]:
+            with self.subTest(split=split):
+                np.testing.assert_array_equal(getattr(sampler, split), getattr(same_sampler, split))
+
+            with self.subTest(split=split):
+                np.testing.assert_array_equal(getattr(sampler, split),
+                                              sampler._encode_(getattr(sampler, f"{split}_ne")))